@@ -1,6 +1,5 @@
 from path import Path
 
-from .qt import QMimeDatabase, Qt
 from .sqlite import Db, Settings
 
 APP_DIR = Path(__file__).parent
@@ -10,4 +9,12 @@ ICONS_DIR = APP_DIR / 'icons'
 
 db = Db(DATA_DIR)
 settings = Settings(db)
-mime_db = QMimeDatabase()
+
+
+def __getattr__(name):
+    # Qt is only imported by the gui, the document server can run without it
+    if name == 'Qt':
+        from .qt import Qt
+
+        return Qt
+    raise AttributeError(f'module {__name__!r} has no attribute {name!r}')
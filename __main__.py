@@ -1,65 +1,128 @@
+import builtins
 import os
 import sys
 
-import colorama
-import icecream
-import pygments
 from path import Path
-from PyQt6.QtQuick import QQuickWindow, QSGRendererInterface
 
-from . import qt
+from . import profiler
+from .startup import StartupProfile
 
 sys.path.append(Path(__file__).parent / r'rapidfuzz\_skbuild\win-amd64-3.12\cmake-install\src')
 
-if sys.platform == 'win32':
-    colorama.just_fix_windows_console()
 
-try:
+def setup_icecream():
+    import icecream
+    import pygments.formatters
+
     try:
-        columns = os.get_terminal_size().columns
-        icecream.icecream.IceCreamDebugger.lineWrapWidth = columns - 4
+        try:
+            columns = os.get_terminal_size().columns
+            icecream.icecream.IceCreamDebugger.lineWrapWidth = columns - 4
+        except OSError:
+            pass
+        icecream.colorize.formatter = pygments.formatters.Terminal256Formatter(style='native')
     except OSError:
         pass
-    icecream.colorize.formatter = pygments.formatters.Terminal256Formatter(style='native')
-except OSError:
-    pass
-icecream.ic.configureOutput(
-    includeContext=True,
-    outputFunction=lambda s: print(icecream.colorize(s), file=sys.stdout),
-)
-icecream.install()
-
-sys.excepthook = qt.excepthook
-
-# prevent flashing when moving docks
-QQuickWindow.setGraphicsApi(QSGRendererInterface.GraphicsApi.OpenGL)
-
-app = qt.QApplication(sys.argv)
-app.setStyle('fusion')
-app.setWindowIcon(qt.QIcon(Path(__file__).parent / 'app.png'))
-app.setStyleSheet(
+    icecream.ic.configureOutput(
+        includeContext=True,
+        outputFunction=lambda s: print(icecream.colorize(s), file=sys.stdout),
+    )
+    icecream.install()
+
+
+def ic(*args):
+    # icecream and pygments are only imported on the first ic() call
+    setup_icecream()
+    return builtins.ic(*args)
+
+
+def setup_console():
+    if sys.platform == 'win32':
+        import colorama
+
+        colorama.just_fix_windows_console()
+
+    builtins.ic = ic
+
+
+def run_gui(profile=None):
+    from PyQt6.QtQuick import QQuickWindow, QSGRendererInterface
+
+    from . import qt
+
+    if profile:
+        profile.mark('import qt')
+
+    sys.excepthook = qt.excepthook
+
+    # prevent flashing when moving docks
+    QQuickWindow.setGraphicsApi(QSGRendererInterface.GraphicsApi.OpenGL)
+
+    app = qt.QApplication(sys.argv)
+    app.setStyle('fusion')
+    app.setWindowIcon(qt.QIcon(Path(__file__).parent / 'app.png'))
+    app.setStyleSheet(
+        """
+        QScrollBar:vertical, QScrollBar:horizontal { background: #525252 }
+        QScrollBar::handle:vertical, QScrollBar::handle:horizontal { background: #696969; }
     """
-    QScrollBar:vertical, QScrollBar:horizontal { background: #525252 }
-    QScrollBar::handle:vertical, QScrollBar::handle:horizontal { background: #696969; }
-"""
-)
-
-try:
-    from .mainwindow import MainWindow
-except Exception as err:
-    import ctypes
-    import traceback
-
-    ctypes.windll.user32.MessageBoxW(None, ''.join(traceback.format_exception(err, limit=5)), str(err), 0)
-    sys.exit(0)
-
-win = MainWindow()
-win.show()
-
-try:
-    app.exec()
-except KeyboardInterrupt:
-    pass
-except Exception as err:
-    print(err)
-    sys.exit(0)
+    )
+    if profile:
+        profile.mark('QApplication')
+
+    try:
+        from .mainwindow import MainWindow
+    except Exception as err:
+        import ctypes
+        import traceback
+
+        ctypes.windll.user32.MessageBoxW(None, ''.join(traceback.format_exception(err, limit=5)), str(err), 0)
+        sys.exit(0)
+
+    if profile:
+        profile.mark('import mainwindow')
+
+    win = MainWindow()
+    if profile:
+        profile.mark('MainWindow()')
+
+        class FirstPaint(qt.QObject):
+            def eventFilter(self, obj, event):
+                if event.type() == qt.QEvent.Type.Paint:
+                    win.removeEventFilter(self)
+                    profile.mark('first paint')
+                    qt.QTimer.singleShot(0, profile.report)
+                return False
+
+        first_paint = FirstPaint(win)
+        win.installEventFilter(first_paint)
+
+    win.show()
+    if profile:
+        profile.mark('show')
+
+    try:
+        app.exec()
+    except KeyboardInterrupt:
+        pass
+    except Exception as err:
+        print(err)
+        sys.exit(0)
+
+
+profile = None
+if '--profile-startup' in sys.argv:
+    sys.argv.remove('--profile-startup')
+    profile = StartupProfile()
+    profile.install()
+
+setup_console()
+
+profiler.start_from_env()
+
+if sys.argv[1:2] == ['serve']:
+    from .serve import main
+
+    sys.exit(main(sys.argv[2:]))
+
+run_gui(profile)
@@ -0,0 +1,45 @@
+from . import DOCS_DIR, settings
+
+DOCS_FILE = DOCS_DIR / 'docs.yaml'
+
+
+def load():
+    import yaml
+
+    with DOCS_FILE.open() as f:
+        return yaml.load(f, Loader=yaml.CLoader)
+
+
+def parse(items):
+    """Convert docs.yaml into a tree of (label, params, children) tuples, params is None for groups"""
+    nodes = []
+    for name, params in items.items():
+        if params is None:
+            params = {}
+
+        if name[0] == '.':
+            nodes.append((name[1:], None, parse(params)))
+        else:
+            children = params.get('children')
+            params = {k: v for k, v in params.items() if k != 'children'}
+            nodes.append((name, params, parse(children) if children else ()))
+    return tuple(nodes)
+
+
+def load_tree():
+    """Parsed docs.yaml, cached in the settings until the file is modified"""
+    stat = DOCS_FILE.stat()
+    key = (stat.st_mtime_ns, stat.st_size)
+    if (cached := settings.get('catalog.tree')) and cached[0] == key:
+        return cached[1]
+    tree = parse(load())
+    settings['catalog.tree'] = (key, tree)
+    return tree
+
+
+def walk(nodes):
+    """Yield (name, params) of every document in the tree"""
+    for name, params, children in nodes:
+        if params is not None:
+            yield name, params
+        yield from walk(children)
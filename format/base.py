@@ -1,13 +1,18 @@
 import os
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 from functools import cached_property
-from urllib.parse import urlparse
+from urllib.parse import urljoin, urlparse
 
-import httpx
 import orjson as json
-import polars as pl
 from recordclass import dataobject
 
 from .. import DOCS_DIR, utils
+from ..metrics import Metrics
+from ..profiler import profiled
+from ..rewrite import Rewriter
+from . import logger, schema
 
 GLOBAL_WHITELIST = {
     'cdnjs.cloudflare.com',
@@ -18,6 +23,7 @@ GLOBAL_WHITELIST = {
     'fonts.googleapis.com',
     'fonts.gstatic.com',
 }
+INDEX_FILES = ('searchindex.js', 'genindex.html', 'index.json', 'index.hhk')
 
 
 class Item(dataobject):
@@ -27,6 +33,47 @@ class Item(dataobject):
     content_type: str = None
     location: str = None
     updated: int = None
+    encoding: str = None  # content is encoded, as stored by a mirror
+
+    def decoded(self):
+        return schema.decode(self.content, self.encoding) if self.encoding else self.content
+
+
+class ItemCache:
+    """Thread-safe LRU of the items of a document bounded by the total size of the content"""
+
+    def __init__(self, max_size):
+        self.max_size = max_size
+        self.size = 0
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __contains__(self, name):
+        return name in self._items
+
+    def get(self, name):
+        with self._lock:
+            if (item := self._items.get(name)) is not None:
+                self._items.move_to_end(name)
+            return item
+
+    def put(self, name, item):
+        size = len(item.content)
+        # a few large files would push out all the pages
+        if size > self.max_size // 8:
+            return
+        with self._lock:
+            if (old := self._items.pop(name, None)) is not None:
+                self.size -= len(old.content)
+            self._items[name] = item
+            self.size += size
+            while self.size > self.max_size:
+                self.size -= len(self._items.popitem(last=False)[1].content)
+
+    def clear(self):
+        with self._lock:
+            self._items.clear()
+            self.size = 0
 
 
 def get_cache_path(url):
@@ -42,10 +89,65 @@ def get_cache_path(url):
 
 
 class BaseFormat:
+    """Subclasses implement _lookup, items are kept in memory by __getitem__"""
+
+    ITEM_CACHE_SIZE = 32 << 20
+
     def __init__(self, name, params):
         self.name = name
         self.whitelist = params.get('whitelist', set())
-        self.reset_counter()
+        self.index = params.get('index')  # location of the index file if it is not in the root
+        self.metrics = Metrics()
+        self.rewriter = Rewriter(params.get('rewrite'))
+        self.items = ItemCache(self.ITEM_CACHE_SIZE)
+        self.prefetcher = None
+        self.last_request = 0  # perf_counter time of the last request of the server, the prefetcher waits until it is idle
+
+    @profiled
+    def __getitem__(self, name):
+        if name.startswith('https://') or name.startswith('http://'):
+            return self.get_external_resource(name)
+
+        if (item := self.items.get(name)) is not None and self._is_current(item):
+            self.metrics.incr('memory')
+            self._cache_hit(item)
+            return item
+        item = self._lookup(name)
+        # errors are not kept, the formats decide how long they are valid
+        if item.status is None or item.status < 400:
+            self.items.put(name, item)
+        return item
+
+    def _lookup(self, name):
+        raise KeyError(name)
+
+    def clear_cache(self):
+        self.items.clear()
+
+    def _is_current(self, item):
+        """Whether a cached item still has the content of the file, the formats reading files that can change check it"""
+        return True
+
+    def _cache_hit(self, item):
+        pass
+
+    @property
+    def _prefetcher(self):
+        if self.prefetcher is None:
+            from .prefetch import Prefetcher
+
+            self.prefetcher = Prefetcher(self)
+            self.prefetcher.start()
+        return self.prefetcher
+
+    def prefetch(self, path, item):
+        """Load the pages linked as next/prev/up and from the toctree of a served page in the background"""
+        self._prefetcher.add(path, item)
+
+    def hint(self, path):
+        """Load a page the user is pointing at, replaces the hint that is not loaded yet, None cancels it"""
+        if path is None or path not in self.items:
+            self._prefetcher.hint(path)
 
     @cached_property
     def format(self):
@@ -58,14 +160,23 @@ class BaseFormat:
         yield name.rstrip('/') + '/index.html' if name else 'index.html'
 
     def reset_counter(self):
-        self.counter = {'fetch': 0, 'cache': 0, 'refresh': 0, 'block': 0}
+        self.metrics.reset_counter()
 
     def process_index(self, path, content):
+        import polars as pl
+
         match os.path.basename(path):
             case 'searchindex.js':
                 return utils.extract_searchindex(content, path)
             case 'genindex.html':
-                return utils.extract_genindex(content, path)
+                symbols, hrefs, pages = utils.read_genindex(content)
+                if pages:
+                    # letter pages of html_split_index, a mirror downloads them concurrently
+                    names = [urljoin(path, page).lstrip('/') for page in pages]
+                    with ThreadPoolExecutor(8) as pool:
+                        contents = [content for content in pool.map(self._read_index_page, names) if content is not None]
+                    return utils.extract_genindex_pages(contents, path)
+                return utils.genindex_frame(symbols, hrefs, path)
             case 'index.json':
                 symbols, locations = json.loads(content)
                 df = pl.DataFrame({'symbol': symbols, 'location': locations})
@@ -74,51 +185,72 @@ class BaseFormat:
             case 'index.hhk':
                 return utils.extract_hhk(content)
 
+    def _read_index_page(self, name):
+        """Content of a page of a split index, None if it is missing so that the rest of the index is still usable"""
+        try:
+            item = self[name]
+        except KeyError:
+            item = None
+        if item is None or (item.status is not None and item.status >= 400):
+            logger.warning('%s: index page %s not found', self.name, name)
+            return None
+        return item.decoded()
+
     def get_index(self):
+        import polars as pl
+
         file = DOCS_DIR / self.name / 'index.json'
         if file.exists():
             return self.process_index(file, file.read_text())
 
+        if self.index:
+            return self.process_index(self.index, self[self.index.lstrip('/')].decoded())
+
         match self.name:
             case 'mdn':
-                df = pl.DataFrame(json.loads(self['en-US/search-index.json'].content)).rename({'title': 'symbol', 'url': 'location'})
+                df = pl.DataFrame(json.loads(self['en-US/search-index.json'].decoded())).rename({'title': 'symbol', 'url': 'location'})
                 df.sort('symbol')
                 return df
             case 'autohotkey':
-                data = json.loads(self['static/source/data_index.js'].content[12:-3])
+                data = json.loads(self['static/source/data_index.js'].decoded()[12:-3])
                 df = pl.DataFrame(data, orient='row').rename(dict(column_0='symbol', column_1='location'))
                 df.sort('symbol')
                 return df
 
-        for file in ('searchindex.js', 'genindex.html', 'index.json', 'index.hhk'):
+        for file in INDEX_FILES:
             try:
                 item = self[file]
                 if item.status == 200 or item.status is None:
-                    return self.process_index(file, item.content)
+                    return self.process_index(file, item.decoded())
                 break
             except KeyError:
                 continue
 
-    def is_whitelisted(self, url):
-        host = url.host()
+    def get_search_index(self):
+        """SearchIndex of the terms of a Sphinx searchindex.js, None for other documents"""
+        from ..search import SearchIndex
+
+        path = self.index if self.index and self.index.endswith('searchindex.js') else 'searchindex.js'
+        try:
+            item = self[path.lstrip('/')]
+        except KeyError:
+            return None
+        if item.status in (None, 200):
+            return SearchIndex.load(item.decoded(), path)
+
+    def is_index(self, name):
+        """Whether get_index can read the file"""
+        return os.path.basename(name) in INDEX_FILES or name.startswith('genindex-') or (self.index is not None and name == self.index.lstrip('/'))
+
+    def is_whitelisted(self, host):
         return host in GLOBAL_WHITELIST or host in self.whitelist
 
     def stop(self):
-        pass
+        if self.prefetcher is not None:
+            self.prefetcher.stop()
 
     def get_external_resource(self, url):
-        cache_path = self.path / os.sep.join(get_cache_path(url))
-        info_path = cache_path.parent / f'{cache_path.name}.json'
-        if cache_path.exists():
-            self.counter['cache'] += 1
-            info = json.loads(info_path.read_text())
-            return Item(url, content=cache_path.read_bytes(), status=info['status'], content_type=info['content-type'])
-
-        self.counter['fetch'] += 1
-        r = httpx.get(url, follow_redirects=True)
-        # cache regardless of status
-        cache_path.parent.makedirs_p()
-        cache_path.write_bytes(r.content)
-        info_path.write_bytes(json.dumps({'status': r.status_code, 'content-type': r.headers.get('content-type')}))
-
-        return Item(url, content=r.content, status=r.status_code, content_type=r.headers.get('content-type'))
+        from .external import get_store
+
+        # resources that were cached in the directory of the document before the shared store are imported on the first use
+        return get_store().get(url, self.metrics, self.path / os.sep.join(get_cache_path(url)))
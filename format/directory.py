@@ -1,8 +1,20 @@
+import os
+import threading
+from time import monotonic
+
 from .. import DOCS_DIR
 from .base import BaseFormat, Item
 
+RESCAN_INTERVAL = 2  # seconds, a name missing from the index rescans the directory at most this often
+
 
 class DirectoryFormat(BaseFormat):
+    """Files are resolved from an index built by scandir, rescan() updates it after the directory changed
+
+    A file rewritten in place is noticed by its stat when it is served, a missing name rescans the directory so that a
+    document served without the viewer also sees the added files.
+    """
+
     def __init__(self, name, params):
         super().__init__(name, params)
         self.path = DOCS_DIR / name
@@ -12,15 +24,122 @@ class DirectoryFormat(BaseFormat):
             self.path = self.path / prefix
         self.start = params.get('start')
 
-    def __getitem__(self, name):
-        if name.startswith('https://') or name.startswith('http://'):
-            return self.get_external_resource(name)
+        # (name -> (path, mtime_ns, size), name and the alternate names of generate_names -> name, directories)
+        # replaced as a whole so that the server threads never see a half updated index
+        self._index = None
+        self._scanned = 0  # monotonic time of the last scan
+        self._changed = set()  # names changed since the last rescan(), also by the server threads
+        self._lock = threading.Lock()
+
+    def _scan(self):
+        files = {}
+        dirs = []
+        stack = ['']
+        while stack:
+            rel = stack.pop()
+            dir = os.path.normpath(os.path.join(self.path, rel))
+            try:
+                it = os.scandir(dir)
+            except (FileNotFoundError, NotADirectoryError):
+                continue
+            dirs.append(dir)
+            with it:
+                for entry in it:
+                    if entry.is_dir():
+                        stack.append(f'{rel}{entry.name}/')
+                    elif entry.is_file():
+                        stat = entry.stat()
+                        files[rel + entry.name] = (entry.path, stat.st_mtime_ns, stat.st_size)
+        return files, dirs
+
+    @staticmethod
+    def _resolve_names(files):
+        names = {name: name for name in files}
+        # in the order of generate_names, an existing name is never replaced by an alternate
+        for name in files:
+            if name.endswith('.html'):
+                names.setdefault(name[:-5], name)
+        for name in files:
+            if name == 'index.html':
+                names.setdefault('', name)
+            elif name.endswith('/index.html'):
+                names.setdefault(name[:-10], name)
+                names.setdefault(name[:-11], name)
+        return names
+
+    def _update(self, max_age=None):
+        with self._lock:
+            # the threads missing the same names while another one scanned use its index
+            if max_age is not None and monotonic() - self._scanned < max_age:
+                return
+            files, dirs = self._scan()
+            old = self._index
+            self._index = (files, self._resolve_names(files), dirs)
+            self._scanned = monotonic()
+            if old is None:
+                return
+            old = old[0]
+
+            changed = {name for name in old.keys() | files.keys() if old.get(name, (None,))[1:] != files.get(name, (None,))[1:]}
+            if changed:
+                self._changed |= changed
+                # items are cached by the requested name which can be an alternate name
+                self.items.clear()
+
+    def rescan(self):
+        """Rebuild the index, return the names of the files that were added, modified or removed since the last call"""
+        self._update()
+        with self._lock:
+            changed, self._changed = self._changed, set()
+        return changed
+
+    def _get_index(self):
+        if self._index is None:
+            self._update()
+        return self._index
+
+    def _set_stat(self, files, name, path, stat):
+        if files[name][1:] != (stat.st_mtime_ns, stat.st_size):
+            with self._lock:
+                files[name] = (path, stat.st_mtime_ns, stat.st_size)
+                self._changed.add(name)
+
+    def _is_current(self, item):
+        # the directory of a file rewritten in place does not change, the watcher of the viewer misses it
+        files = self._get_index()[0]
+        if (entry := files.get(item.name)) is None:
+            return False
+        path, mtime_ns, size = entry
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return False
+        if (stat.st_mtime_ns, stat.st_size) == (mtime_ns, size):
+            return True
+        self._set_stat(files, item.name, path, stat)
+        return False
+
+    def directories(self):
+        return self._get_index()[2]
+
+    def resolve(self, name):
+        return self._get_index()[1].get(name)
 
-        for name in self.generate_names(name):
+    def _lookup(self, name):
+        files, names, _ = self._get_index()
+        if (resolved := names.get(name)) is None and monotonic() - self._scanned > RESCAN_INTERVAL:
+            self._update(RESCAN_INTERVAL)
+            files, names, _ = self._index
+            resolved = names.get(name)
+        if resolved is not None:
+            path = files[resolved][0]
             try:
-                path = self.path / name
-                content = path.read_bytes()
-                return Item(name, content=content, updated=path.mtime)
+                with open(path, 'rb') as f:
+                    stat = os.fstat(f.fileno())
+                    content = f.read()
             except FileNotFoundError:
                 pass
+            else:
+                self._set_stat(files, resolved, path, stat)
+                return Item(resolved, content=content, updated=stat.st_mtime_ns // 1_000_000_000)
         raise KeyError(f'Cannot find {name} in {self.path}')
@@ -0,0 +1,111 @@
+"""Process-wide store of the external resources (jsdelivr, unpkg, Google Fonts...) of every document.
+
+Resources are keyed by URL and the bodies are deduplicated by content hash, so a hit is one lookup and an asset used by
+many documents is only downloaded and stored once.
+"""
+
+import threading
+from concurrent.futures import Future
+
+import orjson as json
+
+from .. import DATA_DIR, sqlite
+from . import logger
+from .base import Item
+from .schema import CREATE_BLOB, content_hash
+
+DBPATH = DATA_DIR / 'external.sqlite'
+
+CREATE_RESOURCE = 'create table if not exists resource (url text not null primary key, status int not null, content_type text, blob_hash blob not null)'
+SELECT = 'select status, content_type, blob.content from resource join blob on blob.hash = resource.blob_hash where url = ?'
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_store():
+    global _store
+    if _store is None:
+        with _store_lock:
+            if _store is None:
+                _store = ExternalStore(DBPATH)
+    return _store
+
+
+class ExternalStore:
+    def __init__(self, dbpath):
+        self.dbpath = dbpath
+        self._local = threading.local()  # connection of each server thread
+        self._lock = threading.Lock()
+        self._inflight = {}  # url -> Future of the fetch, concurrent requests of the same url wait for it
+        self._client = None
+
+        conn = sqlite.connect(dbpath, autocommit=True)
+        conn.execute(CREATE_BLOB)
+        conn.execute(CREATE_RESOURCE)
+        conn.close()
+
+    @property
+    def conn(self):
+        if (conn := getattr(self._local, 'conn', None)) is None:
+            conn = self._local.conn = sqlite.connect(self.dbpath, autocommit=True)
+        return conn
+
+    @property
+    def client(self):
+        if self._client is None:
+            import httpx
+
+            with self._lock:
+                if self._client is None:
+                    self._client = httpx.Client(follow_redirects=True, limits=httpx.Limits(max_connections=10))
+        return self._client
+
+    def get(self, url, metrics, legacy_path=None):
+        """Item of the url, legacy_path is the file of the cache that was kept in the directory of each document"""
+        if row := self.conn.execute(SELECT, (url,)).fetchone():
+            metrics.incr('cache')
+            return Item(url, content=row[2], status=row[0], content_type=row[1])
+
+        with self._lock:
+            future = self._inflight.get(url)
+            owner = future is None
+            if owner:
+                future = self._inflight[url] = Future()
+        if not owner:
+            metrics.incr('cache')
+            return future.result()
+
+        try:
+            if legacy_path is not None and legacy_path.exists():
+                metrics.incr('cache')
+                info = json.loads(legacy_path.parent.joinpath(f'{legacy_path.name}.json').read_bytes())
+                item = Item(url, content=legacy_path.read_bytes(), status=info['status'], content_type=info['content-type'])
+            else:
+                metrics.incr('fetch')
+                with metrics.time('upstream'):
+                    r = self.client.get(url)
+                item = Item(url, content=r.content, status=r.status_code, content_type=r.headers.get('content-type'))
+                logger.info('external %s %s', url, r.status_code)
+            # cache regardless of status
+            self._put(item)
+            future.set_result(item)
+            return item
+        except BaseException as err:
+            future.set_exception(err)
+            raise
+        finally:
+            with self._lock:
+                del self._inflight[url]
+
+    def _put(self, item):
+        conn = self.conn
+        digest = content_hash(item.content)
+        conn.execute('begin immediate')
+        try:
+            conn.execute('insert or ignore into blob (hash, content) values (?, ?)', (digest, item.content))
+            conn.execute('insert or replace into resource (url, status, content_type, blob_hash) values (?, ?, ?, ?)', (item.name, item.status, item.content_type, digest))
+            conn.execute('commit')
+        except Exception:
+            conn.execute('rollback')
+            raise
@@ -1,8 +1,7 @@
 import threading
-from functools import lru_cache
 from queue import Empty, SimpleQueue
 from threading import Thread
-from time import gmtime, strftime
+from time import gmtime, monotonic, strftime
 from urllib.parse import urljoin, urlparse
 
 import httpx
@@ -10,42 +9,171 @@ import orjson as json
 import zstandard as zstd
 
 from .. import DOCS_DIR, sqlite, term, utils
-from . import logger
+from . import logger, schema
 from .base import BaseFormat, Item
+from .schema import content_hash
 
 
 class WriterThread(Thread):
-    """A writer thread to serialize write because MirrorFormat object is run by multiple threads by the web server."""
+    """A writer thread to serialize write because MirrorFormat object is run by multiple threads by the web server.
 
-    def __init__(self, dbpath, queue):
-        super().__init__()
+    When the queue is idle the writer also flushes the access times, evicts rows above the quota and returns free pages
+    to the file system in small steps.
+    """
+
+    FLUSH_INTERVAL = 30  # seconds between writes of the access times
+    EVICT_BATCH = 200
+    VACUUM_PAGES = 256
+
+    def __init__(self, name, dbpath, queue, quota=None, policy='lru', pins=()):
+        super().__init__(name=f'writer-{name}')
         self._dbpath = dbpath
         self._queue = queue
-        self._stop = False
+        self._stopping = False
+        self._quota = quota
+        self._policy = policy
+        self._pins = pins  # paths that are never evicted together with the pages they link to
+        self._evicting = False
+        self._pinned_paths = None  # pins and the pages they link to, read again after a pin is written
+        self._full = None  # used size at which only pinned rows were left, eviction waits for a write or another size
+        self._warned = False
+        self._accessed = {}  # path -> (last access, hits since last flush)
+        self._lock = threading.Lock()
+        self._flushed = monotonic()
+        self.queue_bytes = 0  # size of the bodies waiting in the queue
+
+    def put(self, data, size=0):
+        with self._lock:
+            self.queue_bytes += size
+        self._queue.put(data)
+
+    def record_access(self, path):
+        with self._lock:
+            hits = self._accessed[path][1] if path in self._accessed else 0
+            self._accessed[path] = (utils.epoch(), hits + 1)
 
     def run(self):
         conn = sqlite.connect(self._dbpath, autocommit=True)
         curr = conn.cursor()
         queue = self._queue
-        while not self._stop:
+        # drain the queue before stopping so that no fetched page is lost
+        while not self._stopping or not queue.empty():
             try:
-                data = queue.get(timeout=1)
-                if len(data) == 2:
-                    path, updated = data
-                    curr.execute('update cache set updated = ? where path = ?', (updated, path))
-                else:
-                    curr.execute('insert or replace into cache (path, status, headers, content, updated) values (?, ?, jsonb(?), ?, ?)', data)
+                op, *data = queue.get(timeout=1)
+                match op:
+                    case 'write':
+                        self._write(curr, *data)
+                        self._full = None
+                        with self._lock:
+                            self.queue_bytes -= len(data[3])
+                    case 'updated':
+                        path, updated = data
+                        curr.execute('update cache set updated = ? where path = ?', (updated, path))
+                    case 'alias':
+                        curr.execute('insert or replace into alias (path, target) values (?, ?)', data)
             except Empty:
-                pass
+                self._idle(curr)
+        self._flush(curr)
         conn.close()
 
+    def _write(self, curr, path, status, headers, content, updated, encoding=None):
+        # identical bodies are stored once, a body that is already stored does not need to be compressed again
+        digest = content_hash(content, encoding)
+        if curr.execute('select 1 from blob where hash = ?', (digest,)).fetchone() is None:
+            curr.execute('insert into blob (hash, content) values (?, ?)', (digest, content if encoding else zstd.compress(content)))
+
+        row = curr.execute('select blob_hash, accessed, hits from cache where path = ?', (path,)).fetchone()
+        curr.execute(
+            'insert or replace into cache (path, status, content_type, location, etag, last_modified, encoding, blob_hash, updated, accessed, hits) values (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+            (path, status, headers.get('content-type'), headers.get('location'), headers.get('etag'), headers.get('last-modified'), encoding or 'zstd', digest, updated, *(row[1:] if row else (None, 0))),
+        )
+
+        # remove the previous body of the path if nothing else refers to it
+        if row and row[0] and row[0] != digest:
+            curr.execute('delete from blob where hash = ?1 and not exists (select 1 from cache where blob_hash = ?1)', (row[0],))
+
+        if path in self._pins:
+            self._pinned_paths = None
+
+    def _idle(self, curr):
+        if monotonic() - self._flushed > self.FLUSH_INTERVAL:
+            self._flush(curr)
+
+        if self._quota:
+            used = self._used(curr)
+            # evict down to 90% of the quota so that eviction does not run again on the next fetch
+            if used > self._quota:
+                self._evicting = True
+            elif used < self._quota * 0.9:
+                self._evicting = False
+                self._warned = False
+            if self._evicting and used != self._full:
+                self._flush(curr)
+                if not self._evict(curr):
+                    self._full = used
+
+        if curr.execute('pragma freelist_count').fetchone()[0]:
+            # a no-op for databases that were created without auto_vacuum=incremental, execute() only frees one page
+            curr.executescript(f'pragma incremental_vacuum({self.VACUUM_PAGES})')
+
+    def _used(self, curr):
+        page_count = curr.execute('pragma page_count').fetchone()[0]
+        freelist_count = curr.execute('pragma freelist_count').fetchone()[0]
+        return (page_count - freelist_count) * curr.execute('pragma page_size').fetchone()[0]
+
+    def _flush(self, curr):
+        with self._lock:
+            accessed, self._accessed = self._accessed, {}
+        self._flushed = monotonic()
+        if accessed:
+            curr.execute('begin')
+            curr.executemany('update cache set accessed = ?, hits = hits + ? where path = ?', ((t, hits, path) for path, (t, hits) in accessed.items()))
+            curr.execute('commit')
+
+    def _pinned(self, curr):
+        if self._pinned_paths is None:
+            pinned = set(self._pins)
+            for path in self._pins:
+                row = curr.execute("select blob.content, encoding from cache join blob on blob.hash = cache.blob_hash where path = ? and status = 200 and content_type like 'text/html%'", (path,)).fetchone()
+                if row:
+                    pinned.update(link.lstrip('/') for link in utils.extract_links(schema.decode(*row), '/' + path))
+            self._pinned_paths = pinned
+        return self._pinned_paths
+
+    def _evict(self, curr):
+        """Remove a batch of the least recently or least frequently used rows, return False if nothing can be evicted"""
+        order = 'hits, coalesce(accessed, updated)' if self._policy == 'lfu' else 'coalesce(accessed, updated)'
+        rows = curr.execute(
+            f'select path, blob_hash from cache where path not in (select value from json_each(?)) order by {order} limit {self.EVICT_BATCH}',
+            (json.dumps(list(self._pinned(curr))),),
+        ).fetchall()
+        if not rows:
+            if not self._warned:
+                logger.warning('%s is above its quota but only has pinned pages', self._dbpath)
+                self._warned = True
+            return False
+
+        curr.execute('begin')
+        curr.executemany('delete from cache where path = ?', ((path,) for path, _ in rows))
+        curr.executemany('delete from alias where target = ?', ((path,) for path, _ in rows))
+        curr.executemany('delete from blob where hash = ?1 and not exists (select 1 from cache where blob_hash = ?1)', ((digest,) for digest in {row[1] for row in rows if row[1]}))
+        curr.execute('commit')
+        logger.info('%s evicted %d pages', term.yellow('EVICT'), len(rows))
+        return True
+
 
 class MirrorFormat(BaseFormat):
     """
     - only handles path that are relative to prefix
-    - other resources should be treated just like directory doc accessing external resources
+    - other resources are shared with the other documents in the external store
+    - the size of the cache is bounded by the `quota` param (e.g. 2G), pages are evicted by the `eviction` param (lru or lfu)
+    - bodies are stored in the encoding sent by upstream and decoded when needed, `keep_encoding: false` lets httpx
+      decode them and compresses them again with zstd
     """
 
+    MISS_TTL = 600  # seconds before a missing path is requested again
+    MAX_MISSES = 10_000
+
     def __init__(self, name, params):
         super().__init__(name, params)
 
@@ -57,27 +185,31 @@ class MirrorFormat(BaseFormat):
         self.start = url.path
         if self.start == '':
             self.start = '/'
-        self.index = params.get('index')  # index location on the remote
+        self.keep_encoding = params.get('keep_encoding', True)
 
         self.props = {}
+        self.aliases = {}  # requested path -> stored path, persisted in the alias table
+        self.misses = {}  # path -> (expire time, item of the 404 or None if upstream could not be reached), in the order they expire
+        self._misses_lock = threading.Lock()
         self._init_db()
+        self._local = threading.local()  # connection of each server thread
 
         # cannot use http2, only works with AsyncClient
         self.client = httpx.Client(limits=httpx.Limits(max_connections=5))
         self.queue = SimpleQueue()
-        self.writer = WriterThread(self.dbpath, self.queue)
+        quota = utils.parse_size(params['quota']) if 'quota' in params else None
+        pins = [name for path in (self.start.lstrip('/'), self.index) if path is not None for name in self.generate_names(path)]
+        self.writer = WriterThread(name, self.dbpath, self.queue, quota, params.get('eviction', 'lru'), pins)
         self.writer.start()
 
     def _init_db(self):
         conn = sqlite.connect(self.dbpath, autocommit=True)
-        curr = conn.cursor()
-        curr.execute('create table if not exists prop (key text not null primary key, value blob not null)')
-        curr.execute('create table if not exists cache (path text not null primary key, status int not null, headers jsonb not null, content blob, updated int not null, refresh int default 0 not null)')
+        schema.migrate(conn, self.dbpath)
 
-        curr.execute('select key, value from prop')
         props = self.props
-        for row in curr.fetchall():
+        for row in conn.execute('select key, value from prop'):
             props[row[0]] = json.loads(row[1])
+        self.aliases = dict(conn.execute('select path, target from alias'))
         conn.close()
 
     def get_prop(self, key, default=None):
@@ -91,64 +223,128 @@ class MirrorFormat(BaseFormat):
 
     def get_index(self):
         if self.index:
-            return self.process_index(self.index, self[self.index].content)
+            return self.process_index(self.index, self[self.index].decoded())
         return super().get_index()
 
     def stop(self):
-        self.writer._stop = True
+        super().stop()
+        self.writer._stopping = True
+
+    def clear_cache(self):
+        super().clear_cache()
+        self.misses.clear()
+
+    def _cache_hit(self, item):
+        self.writer.record_access(item.name)
+
+    def _lookup(self, path):
+        # paths that upstream did not find a moment ago
+        if (miss := self.misses.get(path)) is not None:
+            expires, item = miss
+            if monotonic() < expires:
+                self.metrics.incr('miss')
+                if item is None:
+                    raise KeyError(f'{path} is not available')
+                return item
+            self.misses.pop(path, None)
 
-    @lru_cache(20)
-    def __getitem__(self, path):
-        local = threading.local()
-        if not hasattr(local, 'conn'):
-            local.conn = sqlite.connect(self.dbpath)
-        conn = local.conn
+        local = self._local
+        if (conn := getattr(local, 'conn', None)) is None:
+            conn = local.conn = sqlite.connect(self.dbpath)
 
         baseline = self.get_prop('baseline')
 
-        for _path in self.generate_names(path):
-            if row := conn.execute("select status, headers ->> '$.content-type' as content_type, headers ->> '$.location' as location, content, updated from cache where path = ?", (_path,)).fetchone():
-                status, content_type, location, content, updated = row
-                item = Item(_path, zstd.decompress(content) if content else '', status=status, content_type=content_type or 'application/octet-stream', location=location, updated=updated)
+        # the stored path of a previous request goes first, an evicted target falls back to all the names
+        names = self.generate_names(path)
+        if (target := self.aliases.get(path)) is not None:
+            names = (target, *names)
+
+        for _path in names:
+            if row := conn.execute('select status, content_type, location, blob.content, updated, encoding from cache left join blob on blob.hash = cache.blob_hash where path = ?', (_path,)).fetchone():
+                status, content_type, location, content, updated, encoding = row
+                # decoded by the server only if the client does not accept the encoding or the page is rewritten
+                item = Item(_path, content or b'', status=status, content_type=content_type or 'application/octet-stream', location=location, updated=updated, encoding=encoding if content else None)
 
                 # page need to be refreshed
                 if baseline and (updated is None or updated < baseline):
-                    self.counter['refresh'] += 1
-                    return self._fetch(_path, item)
+                    self.metrics.incr('refresh')
+                    return self._fetch(_path, item, *conn.execute('select etag, last_modified from cache where path = ?', (_path,)).fetchone())
 
                 # page is cached
                 # logger.warn('%s %s %s %s', term.blue('CACHE'), _path, status, content_type)
-                self.counter['cache'] += 1
+                self.metrics.incr('cache')
+                self.writer.record_access(_path)
+                if _path != path and self.aliases.get(path) != _path:
+                    self.aliases[path] = _path
+                    self.writer.put(('alias', path, _path))
                 return item
 
+        if target is not None:
+            self.aliases.pop(path, None)
+
         # fetch page
-        self.counter['fetch'] += 1
-        return self._fetch(path)
+        self.metrics.incr('fetch')
+        try:
+            item = self._fetch(path)
+        except httpx.TransportError as err:
+            logger.warning('%s %s %s', term.red('FAILED'), path, err)
+            self._add_miss(path, None)
+            raise KeyError(f'{path} is not available') from err
+        if item.status in (404, 410):
+            self._add_miss(path, item)
+        return item
+
+    def _add_miss(self, path, item):
+        # every entry lives MISS_TTL, the expired ones are at the front and are dropped with the oldest above MAX_MISSES
+        now = monotonic()
+        with self._misses_lock:
+            misses = self.misses
+            misses.pop(path, None)
+            while misses:
+                first = next(iter(misses))
+                if len(misses) < self.MAX_MISSES and (miss := misses.get(first)) is not None and miss[0] > now:
+                    break
+                misses.pop(first, None)
+            misses[path] = (now + self.MISS_TTL, item)
+
+    def _store(self, path, status, headers, content, updated, encoding=None):
+        # hashing and compression is done by the writer thread, header keys are in lower case
+        self.writer.put(('write', path, status, headers, content, updated, encoding), len(content))
 
-    def _fetch(self, path, item=None):
+    def _fetch(self, path, item=None, etag=None, last_modified=None):
         url = urljoin(self.prefix, path)
 
-        # if item is given, do a if-modified-since request
+        # if item is given, do a conditional request
         headers = {}
-        if item and item.updated:
-            headers['If-Modified-Since'] = strftime('%a, %d %b %Y %H:%M:%S GMT', gmtime(item.updated))
+        if etag:
+            headers['If-None-Match'] = etag
+        if item and (last_modified or item.updated):
+            headers['If-Modified-Since'] = last_modified or strftime('%a, %d %b %Y %H:%M:%S GMT', gmtime(item.updated))
+
+        if self.keep_encoding:
+            headers['Accept-Encoding'] = ', '.join(schema.ENCODINGS)
 
         time = utils.epoch()
 
-        r = self.client.get(url, headers=headers)
+        with self.metrics.time('upstream'):
+            r = self.client.send(self.client.build_request('GET', url, headers=headers), stream=True)
+            try:
+                # an encoding that can be stored is kept as received, others are decoded by httpx
+                encoding = r.headers.get('content-encoding', '').strip().lower() or None
+                if self.keep_encoding and encoding in schema.ENCODINGS:
+                    content = b''.join(r.iter_raw())
+                else:
+                    content = r.read()
+                    encoding = None
+            finally:
+                r.close()
         if r.status_code == 304:
             ic(url, r.status_code)
-            self.queue.put((path, time))
+            self.writer.put(('updated', path, time))
             item.updated = time
             return item
 
-        self.queue.put((
-            path,
-            r.status_code,
-            json.dumps(dict(r.headers)),  # all keys in lower case
-            zstd.compress(r.content),
-            time,
-        ))
+        self._store(path, r.status_code, dict(r.headers), content, time, encoding)
         logger.info('%s %s %s %s %s %d %s', term.yellow('FETCH'), url, r.http_version, term.gr(r.status_code, r.status_code == 200), r.headers.get('content-type'), r.headers.get('content-length'), r.headers.get('location'))
 
-        return Item(path, r.content, status=r.status_code, content_type=r.headers.get('content-type', 'application/octet-stream'), location=r.headers.get('location'), updated=time)
+        return Item(path, content, status=r.status_code, content_type=r.headers.get('content-type', 'application/octet-stream'), location=r.headers.get('location'), updated=time, encoding=encoding)
@@ -0,0 +1,88 @@
+import threading
+from collections import deque
+from threading import Thread
+from time import perf_counter, sleep
+
+from .. import utils
+from . import logger
+
+IDLE_DELAY = 0.2  # seconds without a request before prefetching
+MAX_PENDING = 30
+
+
+class Prefetcher(Thread):
+    """Load the pages linked from the last served pages into the item cache (and the mirror cache) while the server is idle.
+
+    Hints of the viewer are loaded first without waiting, a hint that is not loaded yet is replaced by the next one.
+    """
+
+    def __init__(self, doc):
+        super().__init__(name=f'prefetch-{doc.name}', daemon=True)
+        self._doc = doc
+        self._pages = deque(maxlen=3)  # (path, item) of the served pages that are not parsed yet
+        self._pending = deque()
+        self._hint = None  # only the last hint is kept, at most one more is being loaded
+        self._event = threading.Event()
+        self._lock = threading.Lock()
+        self._stopping = False
+
+    def add(self, path, item):
+        with self._lock:
+            self._pages.append((path, item))
+        self._event.set()
+
+    def hint(self, path):
+        self._hint = path
+        self._event.set()
+
+    def stop(self):
+        self._stopping = True
+        self._event.set()
+
+    def run(self):
+        doc = self._doc
+        while not self._stopping:
+            self._event.wait()
+            self._event.clear()
+            while not self._stopping:
+                # links of the newest page first, the pages of older pages are less likely to be opened
+                with self._lock:
+                    pages = list(self._pages)
+                    self._pages.clear()
+                for path, item in reversed(pages):
+                    try:
+                        # decoded here rather than by the request
+                        links = [link.lstrip('/') for link in utils.extract_nav_links(item.decoded(), '/' + path)]
+                    except Exception:
+                        logger.exception('cannot extract the links of %s', path)
+                        continue
+                    self._pending.extendleft(reversed([link for link in links if link not in doc.items]))
+                    while len(self._pending) > MAX_PENDING:
+                        self._pending.pop()
+
+                if (hint := self._hint) is not None:
+                    self._hint = None
+                    self._load(hint, 'hint')
+                    continue
+
+                if not self._pending:
+                    break
+
+                # requests of the viewer go first
+                if (idle := perf_counter() - doc.last_request) < IDLE_DELAY:
+                    sleep(IDLE_DELAY - idle)
+                    continue
+
+                self._load(self._pending.popleft(), 'prefetch')
+
+    def _load(self, path, counter):
+        doc = self._doc
+        if path in doc.items:
+            return
+        try:
+            doc[path]
+            doc.metrics.incr(counter)
+        except KeyError:
+            pass
+        except Exception as err:
+            logger.warning('%s %s failed: %s', counter, path, err)
@@ -0,0 +1,221 @@
+"""Versioned schema of the mirror cache.sqlite, the version is stored as the `version` prop.
+
+- 1: cache.created
+- 2: cache.updated and cache.refresh
+- 3: bodies in the content-addressed blob table, response headers as columns, covering index for metadata lookups
+- 4: cache.accessed and cache.hits for the eviction of size-bounded caches
+- 5: alias table of requested paths that resolved to another stored path
+
+A blob is stored in the encoding of its cache rows: the body as sent by upstream in one of ENCODINGS, or compressed with
+zstd when upstream sent it without encoding.
+
+New databases use auto_vacuum=incremental so that the space of evicted rows is returned in small steps. Converting an
+existing database needs a full vacuum, which is left to scripts/upgradedb.py instead of blocking the viewer.
+"""
+
+import hashlib
+from importlib.util import find_spec
+
+import orjson as json
+
+from . import logger
+
+VERSION = 5
+# the codecs are imported on first use, the viewer imports this module before its first paint
+ENCODINGS = ('zstd', 'br', 'gzip') if find_spec('brotli') else ('zstd', 'gzip')  # upstream encodings that are stored as received
+
+CREATE_PROP = 'create table if not exists prop (key text not null primary key, value blob not null)'
+CREATE_BLOB = 'create table if not exists blob (hash blob not null primary key, content blob not null)'
+CREATE_CACHE = """
+create table if not exists {name} (
+    path text not null primary key,
+    status int not null,
+    content_type text,
+    location text,
+    etag text,
+    last_modified text,
+    encoding text,
+    blob_hash blob,
+    updated int not null,
+    refresh int default 0 not null,
+    accessed int,
+    hits int default 0 not null
+)
+"""
+CREATE_ALIAS = 'create table if not exists alias (path text not null primary key, target text not null)'
+CREATE_INDEXES = (
+    # covers the lookup in MirrorFormat.__getitem__ so that only the blob is read from another b-tree
+    'create index if not exists cache_meta on cache (path, status, content_type, location, encoding, blob_hash, updated)',
+    'create index if not exists cache_blob on cache (blob_hash)',
+    'create index if not exists alias_target on alias (target)',
+)
+
+
+def content_hash(content, encoding=None):
+    """Hash of a body, an encoded body is hashed as received in a separate space for each encoding"""
+    return hashlib.blake2b(content, digest_size=16, person=encoding.encode() if encoding else b'').digest()
+
+
+def decode(content, encoding):
+    match encoding:
+        case None | 'identity':
+            return content
+        case 'zstd':
+            import zstandard
+
+            # streamed responses do not have the content size in the frame header
+            return zstandard.ZstdDecompressor().decompressobj().decompress(content)
+        case 'gzip':
+            import gzip
+
+            return gzip.decompress(content)
+        case 'br' if 'br' in ENCODINGS:
+            import brotli
+
+            return brotli.decompress(content)
+    raise ValueError(f'Cannot decode {encoding}')
+
+
+def encode(content, encoding):
+    match encoding:
+        case None | 'identity':
+            return content
+        case 'zstd':
+            import zstandard
+
+            return zstandard.compress(content)
+        case 'gzip':
+            import gzip
+
+            return gzip.compress(content)
+        case 'br' if 'br' in ENCODINGS:
+            import brotli
+
+            return brotli.compress(content)
+    raise ValueError(f'Cannot encode {encoding}')
+
+
+def has_column(conn, table, column):
+    return any(row[1] == column for row in conn.execute(f"pragma table_info('{table}')"))
+
+
+def has_table(conn, table):
+    return conn.execute("select 1 from sqlite_master where type = 'table' and name = ?", (table,)).fetchone() is not None
+
+
+def get_version(conn):
+    if has_table(conn, 'prop') and (row := conn.execute("select value from prop where key = 'version'").fetchone()):
+        return json.loads(row[0])
+    if not has_table(conn, 'cache'):
+        return None
+    # databases created before the version was recorded
+    return 1 if has_column(conn, 'cache', 'created') else 2
+
+
+def set_version(conn, version):
+    conn.execute("insert or replace into prop (key, value) values ('version', ?)", (json.dumps(version),))
+
+
+def create(conn):
+    # only effective before the first table is created
+    conn.execute('pragma auto_vacuum = incremental')
+    conn.execute(CREATE_PROP)
+    conn.execute(CREATE_BLOB)
+    conn.execute(CREATE_CACHE.format(name='cache'))
+    conn.execute(CREATE_ALIAS)
+    for sql in CREATE_INDEXES:
+        conn.execute(sql)
+    set_version(conn, VERSION)
+
+
+def migrate_2(conn):
+    if has_column(conn, 'cache', 'created'):
+        conn.execute('alter table cache rename column created to updated')
+    if not has_column(conn, 'cache', 'refresh'):
+        conn.execute('alter table cache add column refresh integer default 0 not null')
+
+
+def migrate_3(conn):
+    conn.execute(CREATE_BLOB)
+
+    # bodies are moved without recompression, keyed by the hash of the uncompressed body
+    if has_column(conn, 'cache', 'content'):
+        if not has_column(conn, 'cache', 'blob_hash'):
+            conn.execute('alter table cache add column blob_hash blob')
+        import zstandard
+
+        dctx = zstandard.ZstdDecompressor()
+        last = 0
+        while rows := conn.execute('select rowid, content from cache where rowid > ? and content is not null order by rowid limit 1000', (last,)).fetchall():
+            for rowid, content in rows:
+                digest = content_hash(dctx.decompress(content))
+                conn.execute('insert or ignore into blob (hash, content) values (?, ?)', (digest, content))
+                conn.execute('update cache set blob_hash = ? where rowid = ?', (digest, rowid))
+            last = rows[-1][0]
+
+    conn.execute('drop index if exists cache_blob')
+    conn.execute(CREATE_CACHE.format(name='cache_v3'))
+    conn.execute(
+        """
+        insert into cache_v3 (path, status, content_type, location, etag, last_modified, encoding, blob_hash, updated, refresh)
+        select path, status, headers ->> '$.content-type', headers ->> '$.location', headers ->> '$.etag', headers ->> '$.last-modified',
+            iif(blob_hash is null, null, 'zstd'), blob_hash, updated, refresh
+        from cache
+        """
+    )
+    conn.execute('drop table cache')
+    conn.execute('alter table cache_v3 rename to cache')
+    conn.execute(CREATE_ALIAS)
+    for sql in CREATE_INDEXES:
+        conn.execute(sql)
+
+
+def migrate_4(conn):
+    # cache tables rebuilt by migrate_3 already have the columns
+    if not has_column(conn, 'cache', 'accessed'):
+        conn.execute('alter table cache add column accessed int')
+    if not has_column(conn, 'cache', 'hits'):
+        conn.execute('alter table cache add column hits int default 0 not null')
+
+
+def migrate_5(conn):
+    conn.execute(CREATE_ALIAS)
+    conn.execute('create index if not exists alias_target on alias (target)')
+
+
+MIGRATIONS = {
+    2: migrate_2,
+    3: migrate_3,
+    4: migrate_4,
+    5: migrate_5,
+}
+
+
+def enable_incremental_vacuum(conn):
+    """Switch an existing database to auto_vacuum=incremental, return True if the database had to be rebuilt"""
+    if conn.execute('pragma auto_vacuum').fetchone()[0] == 2:
+        return False
+    conn.execute('pragma auto_vacuum = incremental')
+    conn.execute('vacuum')
+    return True
+
+
+def migrate(conn, path=None):
+    """Create or upgrade the schema of an autocommit connection, return the (old, new) version"""
+    version = get_version(conn)
+    if version is None:
+        create(conn)
+        return None, VERSION
+
+    for target in range(version + 1, VERSION + 1):
+        logger.info('migrate %s to version %d', path or 'cache', target)
+        conn.execute('begin')
+        try:
+            MIGRATIONS[target](conn)
+            conn.execute(CREATE_PROP)
+            set_version(conn, target)
+            conn.execute('commit')
+        except Exception:
+            conn.execute('rollback')
+            raise
+    return version, max(version, VERSION)
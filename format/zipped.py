@@ -1,10 +1,13 @@
 from datetime import datetime
 
+import orjson as json
 from zipfile_zstd import ZipFile
 
 from .. import DOCS_DIR
 from .base import BaseFormat, Item
 
+MANIFEST = '_snapshot.json'
+
 
 class ZippedFormat(BaseFormat):
     def __init__(self, name, params):
@@ -14,20 +17,31 @@ class ZippedFormat(BaseFormat):
         self.zf = ZipFile(self.path / params['zip'])
         self.start = params.get('start')
 
+        # written by scripts/exportmirror.py
+        self.redirects = {}
+        self.content_types = {}
+        try:
+            with self.zf.open(self.prefix + MANIFEST) as f:
+                manifest = json.loads(f.read())
+            self.redirects = manifest.get('redirects', {})
+            self.content_types = manifest.get('content_types', {})
+        except KeyError:
+            pass
+
     def __del__(self):
         self.zf.close()
 
-    def __getitem__(self, name):
-        if name.startswith('https://') or name.startswith('http://'):
-            return self.get_external_resource(name)
-
+    def _lookup(self, name):
         for name in self.generate_names(name):
+            if redirect := self.redirects.get(name):
+                status, location = redirect
+                return Item(name, content=b'', status=status, location=location)
             try:
                 path = self.prefix + name
-                with self.zf.open(path) as f:
+                with self.zf.open(path) as f, self.metrics.time('decompress'):
                     content = f.read()
                 info = self.zf.getinfo(path)
-                return Item(name, content=content, updated=int(datetime(*info.date_time).timestamp()))
+                return Item(name, content=content, content_type=self.content_types.get(name), updated=int(datetime(*info.date_time).timestamp()))
             except KeyError:
                 pass
         raise KeyError(f'Cannot find {name} in {self.path}')
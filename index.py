@@ -1,12 +1,76 @@
+import logging
 import re
+from concurrent.futures import ThreadPoolExecutor
+from time import perf_counter
 
 import polars as pl
 
 from . import Qt, qt
+from .profiler import profiled
+
+logger = logging.getLogger(__name__)
 
 MAX_RESULT = 50
+DWELL_TIME = 150  # ms on an entry before its page is prefetched
+MIN_DELAY = 30  # ms, bounds of the filter delay adapted to the cost of the filter
+MAX_DELAY = 300
+TRIGRAM_MIN_ROWS = 100_000  # smaller indexes are scanned faster than the postings are intersected
 ws_re = re.compile(r'\s+')
 
+_executor = None
+
+
+def _get_executor():
+    # one thread filters for every index, the queries run in order and the stale ones are skipped
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(1, thread_name_prefix='filter')
+    return _executor
+
+
+class TrigramIndex:
+    """Rows of the symbols containing each trigram, a substring is only searched in the rows having all its trigrams"""
+
+    def __init__(self, symbols):
+        postings = (
+            pl.DataFrame({'symbol': symbols})
+            .with_row_index('row')
+            .with_columns(offset=pl.int_ranges(0, pl.col.symbol.str.len_chars().cast(pl.Int64) - 2))
+            .explode('offset')
+            .drop_nulls('offset')
+            .select(pl.col.symbol.str.slice(pl.col.offset, 3).alias('gram'), 'row')
+            .group_by('gram')
+            .agg(pl.col.row.unique().sort())
+            .sort('gram')
+        )
+        self._grams = postings['gram']
+        self._rows = postings['row']
+
+    def estimated_size(self):
+        return self._grams.estimated_size() + self._rows.estimated_size()
+
+    def rows(self, words):
+        """Sorted rows containing every trigram of the words, None when the words are too short to have one"""
+        grams = {word[i : i + 3] for word in words for i in range(len(word) - 2)}
+        if not grams:
+            return None
+
+        postings = []
+        for gram in grams:
+            i = self._grams.search_sorted(gram)
+            if i == len(self._grams) or self._grams[i] != gram:
+                return pl.Series('row', [], pl.UInt32)
+            postings.append(self._rows[i])
+
+        # intersect from the shortest list
+        postings.sort(key=len)
+        rows = postings[0]
+        for other in postings[1:]:
+            if rows.is_empty():
+                break
+            rows = rows.filter(rows.is_in(other))
+        return rows
+
 
 class Model(qt.QAbstractListModel):
     def __init__(self, df):
@@ -14,6 +78,7 @@ class Model(qt.QAbstractListModel):
 
         self._df = df.with_columns(symboll=pl.col.symbol.str.to_lowercase()).sort('symboll')
         self._items = self._df
+        self._trigrams = None  # TrigramIndex of a large index, built by the first substring search
 
     def rowCount(self, index):
         return len(self._items)
@@ -37,36 +102,55 @@ class Model(qt.QAbstractListModel):
             case Qt.ToolTipRole:
                 return self._items[index.row(), 'location']
 
-    def _filter(self, text):
+    @profiled
+    def _query(self, text, stale=lambda: False):
+        """Rows matching the words of text, None when stale() tells that a newer query replaced this one"""
         if text is None or text == '' or len(text) < 3:
-            result = self._df
-        else:
-            df = self._df
-            words = ws_re.split(text)
+            return self._df
+
+        df = self._df
+        words = [word.lower() for word in ws_re.split(text)]
 
-            word = words.pop(0).lower()
+        # every word is a substring of the matching symbols
+        if (rows := self._trigram_rows(words)) is not None:
+            df = df[rows]
 
-            # get rows starting with first word
-            result = df.filter(pl.col.symboll.str.starts_with(word))
+        word = words.pop(0)
 
-            # get rows containing first word
-            if len(result) < MAX_RESULT:
-                result = result.vstack(df.filter(~pl.col.symboll.str.starts_with(word) & pl.col.symboll.str.contains(word, literal=True)))
+        # get rows starting with first word
+        result = df.filter(pl.col.symboll.str.starts_with(word))
 
-            # subsequent words are used to filter the result
-            for word in words:
-                result = result.filter(pl.col.symboll.str.contains(word.lower(), literal=True))
+        # get rows containing first word
+        if len(result) < MAX_RESULT:
+            if stale():
+                return None
+            result = result.vstack(df.filter(~pl.col.symboll.str.starts_with(word) & pl.col.symboll.str.contains(word, literal=True)))
 
-            result = result.sort(pl.col.symboll.str.len_bytes())
+        # subsequent words are used to filter the result
+        for word in words:
+            if stale():
+                return None
+            result = result.filter(pl.col.symboll.str.contains(word, literal=True))
 
-        if result is not self._items:
+        return result.sort(pl.col.symboll.str.len_bytes())
+
+    def _trigram_rows(self, words):
+        if len(self._df) < TRIGRAM_MIN_ROWS:
+            return None
+        if self._trigrams is None:
+            self._trigrams = TrigramIndex(self._df['symboll'])
+        return self._trigrams.rows(words)
+
+    def _set_items(self, items):
+        if items is not self._items:
             self.beginResetModel()
-            self._items = result
+            self._items = items
             self.endResetModel()
 
 
 class List(qt.QListView):
     _item_clicked = qt.Signal(str)
+    _item_dwelled = qt.Signal(object)  # location of the hovered or selected entry, None when the pointer leaves the list
     _key_up = qt.Signal()
     _letter_pressed = qt.Signal(str)
 
@@ -86,12 +170,29 @@ class List(qt.QListView):
 
         self.clicked.connect(self._open_location)
 
+        self._dwell_row = None
+        self._dwell_timer = timer = qt.QTimer(self)
+        timer.setSingleShot(True)
+        timer.setInterval(DWELL_TIME)
+        timer.timeout.connect(self._dwelled)
+
     def mouseMoveEvent(self, event):
-        if self.indexAt(event.pos()).isValid():
+        index = self.indexAt(event.pos())
+        if index.isValid():
             self.setCursor(Qt.PointingHandCursor)
+            self._dwell(index)
         else:
             self.setCursor(Qt.ArrowCursor)
 
+    def leaveEvent(self, event):
+        super().leaveEvent(event)
+        self._dwell(None)
+
+    def currentChanged(self, current, previous):
+        super().currentChanged(current, previous)
+        if current.isValid():
+            self._dwell(current)
+
     def keyPressEvent(self, event):
         key = event.key()
         if key == Qt.Key_Up:
@@ -109,8 +210,24 @@ class List(qt.QListView):
             return
         super().keyPressEvent(event)
 
-    def _filter(self, text):
-        self._model._filter(text)
+    def _set_items(self, items):
+        self._dwell(None)
+        self._model._set_items(items)
+
+    def _dwell(self, index):
+        row = index.row() if index is not None else None
+        if row == self._dwell_row:
+            return
+        self._dwell_row = row
+        if row is None:
+            self._dwell_timer.stop()
+            self._item_dwelled.emit(None)
+        else:
+            self._dwell_timer.start()
+
+    def _dwelled(self):
+        if self._dwell_row is not None and self._dwell_row < len(self._model._items):
+            self._item_dwelled.emit(self._model._items[self._dwell_row, 'location'])
 
     def _open_location(self, index):
         if index.isValid():
@@ -140,22 +257,48 @@ class LineEdit(qt.QLineEdit):
 
 
 class Widget(qt.QWidget):
+    """Symbols of the index, or the pages matching the words of the search with the page mode of Sphinx documents"""
+
     _item_clicked = qt.Signal(str)
+    _item_dwelled = qt.Signal(object)
+    _filtered = qt.Signal(int, object, float)  # generation, items, seconds, emitted by the filter thread
 
-    def __init__(self, data):
+    def __init__(self, data, search=None):
         super().__init__()
 
         self._search_text = None
+        self._load_search = search  # loads the SearchIndex when the page mode is first enabled
+        self._search_index = None
+        self._page_mode = False
+
+        # only the result of the latest query is shown, the older ones are abandoned
+        self._generation = 0
+        self._shown = 0
+        self._filter_cost = None
+        self._open_first = False
+        self._filtered.connect(self._apply_filter)
 
         layout = qt.QVBoxLayout(self)
         layout.setContentsMargins(0, 0, 0, 0)
         layout.setSpacing(0)
 
+        edit_layout = qt.QHBoxLayout()
+        edit_layout.setSpacing(0)
+        layout.addLayout(edit_layout)
+
         self._edit = edit = LineEdit()
-        layout.addWidget(edit)
+        edit_layout.addWidget(edit)
+        if search is not None:
+            self._page_button = button = qt.QToolButton()
+            button.setText('P')
+            button.setCheckable(True)
+            button.setToolTip('Search the words of the pages')
+            button.toggled.connect(self._set_page_mode)
+            edit_layout.addWidget(button)
         @edit.textChanged
         def _(text):
             self._search_text = text
+            self._open_first = False
             self._timer.stop()
             self._timer.start()
 
@@ -165,17 +308,72 @@ class Widget(qt.QWidget):
         self._list = lst = List(data)
         layout.addWidget(lst)
         lst._item_clicked.connect(self._item_clicked)
+        lst._item_dwelled.connect(self._item_dwelled)
         lst._key_up.connect(self._focus_edit)
         lst._letter_pressed.connect(self._search)
 
         self._timer = timer = qt.QTimer()
         timer.setSingleShot(True)
         timer.setInterval(100)
-        timer.timeout.connect(lambda: self._list._filter(self._search_text))
+        timer.timeout.connect(self._filter)
 
     def sizeHint(self):
         return qt.QSize(150, 100)
 
+    def _filter(self):
+        self._timer.stop()
+        self._generation += 1
+        _get_executor().submit(self._run_filter, self._generation, self._search_text, self._page_mode)
+
+    def _run_filter(self, generation, text, page_mode):
+        # filter thread, the GUI thread keeps handling the typing
+        def stale():
+            return generation != self._generation
+
+        if stale():
+            return
+        t = perf_counter()
+        try:
+            if page_mode:
+                items = self._search_index.search(text or '')
+            else:
+                items = self._list._model._query(text, stale)
+        except Exception:
+            logger.exception('filter %r failed', text)
+            return
+        if items is not None and not stale():
+            try:
+                self._filtered.emit(generation, items, perf_counter() - t)
+            except RuntimeError:  # the widget was deleted
+                pass
+
+    def _apply_filter(self, generation, items, cost):
+        # wait longer for the next key when the filter is slow
+        self._filter_cost = cost if self._filter_cost is None else (self._filter_cost + cost) / 2
+        self._timer.setInterval(min(MAX_DELAY, max(MIN_DELAY, int(self._filter_cost * 2000))))
+
+        if generation != self._generation:
+            return
+        self._shown = generation
+        self._list._set_items(items)
+        if self._open_first:
+            self._open_first = False
+            self._select_first_result()
+
+    def _set_page_mode(self, enabled):
+        if enabled and self._search_index is None:
+            if (index := self._load_search()) is None:
+                button = self._page_button
+                button.setChecked(False)
+                button.setEnabled(False)
+                button.setToolTip('The document has no term index')
+                return
+            self._search_index = index
+        self._page_mode = enabled
+        self._edit.setPlaceholderText('Search pages' if enabled else '')
+        self._filter()
+        self._focus_edit()
+
     def _focus_edit(self):
         self._edit.setFocus(Qt.TabFocusReason)
 
@@ -185,6 +383,12 @@ class Widget(qt.QWidget):
         ls.setCurrentIndex(ls._model.index(0, 0, qt.QModelIndex()))
 
     def _select_first_result(self):
+        # enter was pressed before the result of the text was shown
+        if self._timer.isActive():
+            self._filter()
+        if self._shown != self._generation:
+            self._open_first = True
+            return
         model = self._list._model
         if len(model._items):
             self._item_clicked.emit(model._items[0, 'location'])
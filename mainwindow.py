@@ -1,9 +1,16 @@
+import logging
+
 from path import Path
 
-from . import DOCS_DIR, Qt, qt, settings, utils
+from . import DOCS_DIR, Qt, memory, profiler, qt, settings, utils
 from .stack import StackWidget
 from .status import StatusBar
 from .tree import TreeWidget
+from .viewer import ViewerWidget
+
+logger = logging.getLogger(__name__)
+
+MEMORY_LOG_INTERVAL = 5 * 60 * 1000
 
 
 class MainWindow(qt.QMainWindow):
@@ -24,15 +31,23 @@ class MainWindow(qt.QMainWindow):
             Qt.SHIFT | Qt.Key_F3: self._search_prev,
             Qt.Key_Escape: self._search_clear,
             Qt.CTRL | Qt.SHIFT | Qt.Key_I: self._toggle_inspector,
+            Qt.CTRL | Qt.SHIFT | Qt.Key_M: self._show_memory,
+            Qt.CTRL | Qt.SHIFT | Qt.Key_P: self._toggle_profile,
         },)
 
+        # memory of long sessions
+        self._memory_timer = timer = qt.QTimer(self)
+        timer.setInterval(MEMORY_LOG_INTERVAL)
+        timer.timeout.connect(self._log_memory)
+        timer.start()
+
     def _setup_ui(self):
         # status bar
         self._status = status = StatusBar(self)
         self.setStatusBar(status)
         @status._search_changed
         def _(text):
-            if viewer := self._stack.currentWidget():
+            if viewer := self._current_viewer:
                 viewer._page.findText(text)
 
         # main widget
@@ -42,15 +57,13 @@ class MainWindow(qt.QMainWindow):
         layout.setSpacing(0)
 
         self._tree = tree = TreeWidget(self)
-        @tree.itemClicked
-        def _(item):
-            if data := item.data(0, Qt.UserRole):
-                self._stack._open(data)
+        @tree._doc_clicked
+        def _(data):
+            self._stack._open(data)
         @tree._letter_pressed
         def _(text):
             ic(text)
-            if index := self._stack.currentWidget()._index:
-                index._search(text)
+            self._search_index(text)
         layout.addWidget(tree)
 
         self._stack = stack = StackWidget()
@@ -62,9 +75,24 @@ class MainWindow(qt.QMainWindow):
 
         self.setCentralWidget(widget)
 
-        # open first document to prevent flashing
-        tree.setCurrentItem(tree._start_item)
-        stack._open(tree._start_item.data(0, Qt.UserRole))
+    def _restore_session(self):
+        # documents of the previous session are added as placeholders, only the active one is loaded
+        tree = self._tree
+        session = settings.get('session') or {}
+        restored = []
+        for name, path in session.get('docs', ()):
+            if data := tree._model._find(name).data(Qt.UserRole):
+                self._stack._add_placeholder(data, path)
+                restored.append(name)
+
+        index = tree._model._find(session['active']) if session.get('active') else qt.QModelIndex()
+        if not index.isValid():
+            index = tree._start_index
+        if not index.isValid() and restored:
+            index = tree._model._find(restored[0])
+        if data := index.data(Qt.UserRole):
+            tree.setCurrentIndex(index)
+            self._stack._open(data)
 
     def keyPressEvent(self, event):
         # uppercase letter is determined by shift key, the code is the same with the lowercase letter
@@ -75,6 +103,7 @@ class MainWindow(qt.QMainWindow):
 
     def closeEvent(self, event):
         settings['window.geometry'] = self.saveGeometry()
+        settings['session'] = self._stack._session()
         # settings['window.dock'] = self._dock_manager.saveState()
 
         stack = self._stack
@@ -90,25 +119,30 @@ class MainWindow(qt.QMainWindow):
             except TypeError:
                 pass
             self._restored = True
+            # show the window before loading any document
+            qt.QTimer.singleShot(0, self._restore_session)
 
     def changeEvent(self, event):
         if event.type() == qt.QEvent.Type.ActivationChange and self.isActiveWindow():
             qt.setLastHwnd(self)
 
     @property
-    def _current_page(self):
-        return self._stack.currentWidget()._page
+    def _current_viewer(self):
+        # a placeholder of the previous session has no page until it is opened
+        if isinstance(viewer := self._stack.currentWidget(), ViewerWidget):
+            return viewer
 
     def _trigger_action(self, action):
-        self._current_page.triggerAction(getattr(qt.QWebEnginePage.WebAction, action))
+        if viewer := self._current_viewer:
+            viewer._page.triggerAction(getattr(qt.QWebEnginePage.WebAction, action))
 
     def _search_index(self, text):
-        if index := self._stack.currentWidget()._index:
+        if (viewer := self._current_viewer) and (index := viewer._index):
             index._search(text)
 
     def _update_title(self, title):
-        if item := self._tree.currentItem():
-            self.setWindowTitle(f'{item.text(0)} | {title}')
+        if (index := self._tree.currentIndex()).isValid():
+            self.setWindowTitle(f'{index.data()} | {title}')
 
     def _search(self):
         input = self._status._search
@@ -119,26 +153,43 @@ class MainWindow(qt.QMainWindow):
     def _search_next(self):
         input = self._status._search
         if text := input.text().strip():
-            if viewer := self._stack.currentWidget():
+            if viewer := self._current_viewer:
                 viewer._page.findText(text)
 
     def _search_prev(self):
         input = self._status._search
         if text := input.text().strip():
-            if viewer := self._stack.currentWidget():
+            if viewer := self._current_viewer:
                 viewer._page.findText(text, qt.QWebEnginePage.FindFlag.FindBackward)
 
     def _search_clear(self):
-        if viewer := self._stack.currentWidget():
+        if viewer := self._current_viewer:
             viewer._page.findText('')
 
     def _set_baseline(self):
-        if viewer := self._stack.currentWidget():
+        if viewer := self._current_viewer:
             if viewer._doc.format == 'mirror':
                 viewer._doc.set_prop('baseline', utils.epoch())
-                viewer._doc.__getitem__.cache_clear()
+                viewer._doc.clear_cache()
                 self._status._set_doc(viewer._doc)
 
+    def _show_memory(self):
+        if viewer := self._current_viewer:
+            self._status._show_memory(memory.viewer_report(viewer), memory.process_report())
+
+    def _log_memory(self):
+        process = memory.process_report()
+        logger.info('memory rss %s threads %d rewrite cache %s', memory.format_size(process['rss']), process['threads'], memory.format_size(process['rewrite_cache_bytes']))
+        for viewer in self._stack._viewers.values():
+            if isinstance(viewer, ViewerWidget):
+                logger.info('memory %s: %s', viewer._doc.name, memory.summary(memory.viewer_report(viewer)))
+
+    def _toggle_profile(self):
+        if file := profiler.toggle():
+            self._status.showMessage(f'PROFILE written to {file}', 15000)
+        else:
+            self._status.showMessage('PROFILE started, Ctrl+Shift+P to stop')
+
     def _toggle_inspector(self):
-        if viewer := self._stack.currentWidget():
+        if viewer := self._current_viewer:
             viewer._toggle_inspector()
@@ -0,0 +1,83 @@
+"""Memory used by each open document: index frames, in-process caches, queued writes, threads and the renderer."""
+
+import threading
+
+from .rewrite import Rewriter
+
+
+def process_rss(pid='self'):
+    """Resident set size of a process in bytes from /proc, None where it is not available"""
+    try:
+        with open(f'/proc/{pid}/status') as f:
+            for line in f:
+                if line.startswith('VmRSS:'):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return None
+
+
+def format_size(size):
+    if size is None:
+        return '?'
+    for unit in ('B', 'KB', 'MB'):
+        if size < 1024:
+            return f'{size:.0f}{unit}' if unit == 'B' else f'{size:.1f}{unit}'
+        size /= 1024
+    return f'{size:.1f}GB'
+
+
+def doc_report(doc):
+    report = {
+        'items': len(doc.items._items),
+        'items_bytes': doc.items.size,
+        'threads': sum(1 for thread in threading.enumerate() if thread.name.endswith(f'-{doc.name}')),
+    }
+    if doc.format == 'mirror':
+        report['queue_bytes'] = doc.writer.queue_bytes
+    return report
+
+
+def viewer_report(viewer):
+    report = {'name': viewer._doc.name, 'index_bytes': 0, 'symboll_bytes': 0, 'search_bytes': 0}
+    if index := viewer._index:
+        model = index._list._model
+        report['index_bytes'] = model._df.estimated_size()
+        # lower case copy of the symbols used by the filter
+        report['symboll_bytes'] = model._df['symboll'].estimated_size()
+        if model._trigrams is not None:
+            report['trigram_bytes'] = model._trigrams.estimated_size()
+        if search := index._search_index:
+            report['search_bytes'] = search._terms.estimated_size() + search._pages.estimated_size()
+    report.update(doc_report(viewer._doc))
+
+    # pages of the same site can share a renderer process
+    pid = viewer._page.renderProcessPid()
+    report['renderer_pid'] = pid
+    report['renderer_rss'] = process_rss(pid) if pid else None
+    return report
+
+
+def process_report():
+    return {
+        'rss': process_rss(),
+        'threads': threading.active_count(),
+        'rewrite_cache_bytes': Rewriter._cache_size,
+    }
+
+
+def summary(report):
+    """One line of a viewer report for the status bar and the log"""
+    parts = [
+        f"index {format_size(report['index_bytes'])}",
+        f"items {format_size(report['items_bytes'])} ({report['items']})",
+    ]
+    if report.get('trigram_bytes'):
+        parts.append(f"trigrams {format_size(report['trigram_bytes'])}")
+    if report['search_bytes']:
+        parts.append(f"search {format_size(report['search_bytes'])}")
+    if 'queue_bytes' in report:
+        parts.append(f"queue {format_size(report['queue_bytes'])}")
+    parts.append(f"threads {report['threads']}")
+    parts.append(f"renderer {format_size(report['renderer_rss'])}")
+    return ' '.join(parts)
@@ -0,0 +1,117 @@
+import threading
+from bisect import bisect_left
+from contextlib import contextmanager
+from time import perf_counter
+
+# upper bounds of the histogram buckets, the last bucket catches everything above
+TIME_BUCKETS = (0.00001, 0.00005, 0.0001, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+SIZE_BUCKETS = tuple(1 << n for n in range(8, 28, 2))  # 256 bytes .. 64 MB
+RATIO_BUCKETS = (0.1, 0.2, 0.3, 0.4, 0.5, 0.6, 0.7, 0.8, 0.9, 0.95, 0.99, 1)
+
+COUNTERS = ('fetch', 'cache', 'memory', 'refresh', 'block')
+
+
+class Histogram:
+    """Fixed bucket histogram, not thread-safe by itself, guarded by the lock of Metrics."""
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.sum = 0
+        self.max = 0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+        if value > self.max:
+            self.max = value
+
+    def percentile(self, q):
+        """Upper bound of the bucket containing the q-th percentile"""
+        if not self.count:
+            return 0
+        rank = q * self.count
+        seen = 0
+        for i, n in enumerate(self.counts):
+            seen += n
+            if seen >= rank:
+                return self.buckets[i] if i < len(self.buckets) else self.max
+        return self.max
+
+    def summary(self):
+        return {
+            'count': self.count,
+            'sum': self.sum,
+            'mean': self.sum / self.count if self.count else 0,
+            'p50': self.percentile(0.5),
+            'p90': self.percentile(0.9),
+            'p99': self.percentile(0.99),
+            'max': self.max,
+            # json object keys are strings
+            'buckets': {str(bound): n for bound, n in zip((*self.buckets, 'inf'), self.counts)},
+        }
+
+
+class Metrics:
+    """Per document counters and histograms, updated by the web server threads.
+
+    `counter` is reset on every page load and used by the status bar, `total` and the histograms accumulate since the document was opened.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.counter = dict.fromkeys(COUNTERS, 0)
+        self.total = dict.fromkeys(COUNTERS, 0)
+        self.histograms = {}
+
+    def incr(self, key, n=1):
+        with self._lock:
+            self.counter[key] = self.counter.get(key, 0) + n
+            self.total[key] = self.total.get(key, 0) + n
+
+    def observe(self, key, value, buckets=TIME_BUCKETS):
+        with self._lock:
+            if (hist := self.histograms.get(key)) is None:
+                hist = self.histograms[key] = Histogram(buckets)
+            hist.observe(value)
+
+    @contextmanager
+    def time(self, key):
+        t = perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(key, perf_counter() - t)
+
+    def reset_counter(self):
+        with self._lock:
+            counter = self.counter
+            self.counter = dict.fromkeys(COUNTERS, 0)
+        if ratio := self._hit_ratio(counter):
+            self.observe('hit_ratio', ratio, RATIO_BUCKETS)
+
+    @staticmethod
+    def _hit_ratio(counter):
+        # served from the item cache of the document or from the mirror database
+        hits = counter.get('memory', 0) + counter.get('cache', 0)
+        total = hits + counter.get('fetch', 0) + counter.get('refresh', 0)
+        return hits / total if total else None
+
+    def hit_ratio(self):
+        return self._hit_ratio(self.total)
+
+    def summary(self, key):
+        with self._lock:
+            if hist := self.histograms.get(key):
+                return hist.summary()
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                'counter': dict(self.counter),
+                'total': dict(self.total),
+                'hit_ratio': self._hit_ratio(self.total),
+                'histograms': {k: v.summary() for k, v in self.histograms.items()},
+            }
@@ -0,0 +1,200 @@
+"""Profiles of a running viewer or server, off by default.
+
+Enabled with QDOCVIEWER_PROFILE=sample|cprofile or toggled with Ctrl+Shift+P in the viewer, the files are written to
+data/profiles when the profile stops:
+
+- sample: a thread samples the stacks of all the threads, written as a speedscope file (https://www.speedscope.app)
+- cprofile: the functions decorated with @profiled and the main thread (the Qt event loop) run under cProfile, written
+  as a pstats file
+"""
+
+import atexit
+import cProfile
+import functools
+import logging
+import os
+import pstats
+import sys
+import threading
+from datetime import datetime
+from time import perf_counter, sleep
+
+import orjson as json
+
+from . import DATA_DIR
+
+logger = logging.getLogger(__name__)
+
+ENV = 'QDOCVIEWER_PROFILE'
+PROFILES_DIR = DATA_DIR / 'profiles'
+SAMPLE_INTERVAL = 0.005
+SESSION = datetime.now().strftime('%Y%m%d-%H%M%S')
+
+_active = None
+_count = 0
+
+
+def profiled(func):
+    """Run func under the cProfile profiler of its thread while a cprofile profile is active"""
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        if _active is None or _active.mode != 'cprofile':
+            return func(*args, **kwargs)
+        return _active.run(func, args, kwargs)
+
+    return wrapper
+
+
+class Sampler(threading.Thread):
+    def __init__(self, interval):
+        super().__init__(name='profiler', daemon=True)
+        self.interval = interval
+        self.frames = []  # (name, file, line)
+        self.frame_ids = {}
+        self.samples = {}  # thread id -> list of stacks as frame ids from the root
+        self.weights = {}
+        self._stopping = False
+
+    def run(self):
+        own = threading.get_ident()
+        last = perf_counter()
+        while not self._stopping:
+            sleep(self.interval)
+            now = perf_counter()
+            weight, last = now - last, now
+            for tid, frame in sys._current_frames().items():
+                if tid == own:
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    key = (code.co_qualname, code.co_filename, code.co_firstlineno)
+                    if (i := self.frame_ids.get(key)) is None:
+                        i = self.frame_ids[key] = len(self.frames)
+                        self.frames.append(key)
+                    stack.append(i)
+                    frame = frame.f_back
+                stack.reverse()
+                self.samples.setdefault(tid, []).append(stack)
+                self.weights.setdefault(tid, []).append(weight)
+
+    def speedscope(self, name):
+        threads = {thread.ident: thread.name for thread in threading.enumerate()}
+        profiles = []
+        for tid, samples in self.samples.items():
+            weights = self.weights[tid]
+            profiles.append({
+                'type': 'sampled',
+                'name': threads.get(tid, str(tid)),
+                'unit': 'seconds',
+                'startValue': 0,
+                'endValue': sum(weights),
+                'samples': samples,
+                'weights': weights,
+            })
+        return {
+            '$schema': 'https://www.speedscope.app/file-format-schema.json',
+            'name': name,
+            'exporter': 'qdocviewer',
+            'shared': {'frames': [{'name': func, 'file': file, 'line': line} for func, file, line in self.frames]},
+            'profiles': profiles,
+        }
+
+
+class Profile:
+    def __init__(self, mode):
+        global _count
+        _count += 1
+        self.mode = mode
+        self.name = f'{SESSION}-{_count}'
+        self._sampler = None
+        self._profiles = []
+        self._local = threading.local()
+        self._lock = threading.Lock()
+
+    def start(self):
+        if self.mode == 'sample':
+            self._sampler = Sampler(SAMPLE_INTERVAL)
+            self._sampler.start()
+        else:
+            # the thread starting the profile is the main thread running the event loop
+            self._profiler().enable()
+            self._local.enabled = True
+
+    def stop(self):
+        """Write the profile, return the file name"""
+        PROFILES_DIR.makedirs_p()
+        if self._sampler is not None:
+            self._sampler._stopping = True
+            self._sampler.join()
+            file = PROFILES_DIR / f'{self.name}.speedscope.json'
+            file.write_bytes(json.dumps(self._sampler.speedscope(self.name)))
+        else:
+            if getattr(self._local, 'enabled', False):
+                self._local.profile.disable()
+            file = PROFILES_DIR / f'{self.name}.pstats'
+            with self._lock:
+                profiles = [profile for profile in self._profiles if profile.getstats()]
+            if not profiles:
+                return None
+            pstats.Stats(*profiles).dump_stats(file)
+        logger.info('profile written to %s', file)
+        return file
+
+    def _profiler(self):
+        # a cProfile profiler only sees the thread that enabled it
+        if (profile := getattr(self._local, 'profile', None)) is None:
+            profile = self._local.profile = cProfile.Profile()
+            with self._lock:
+                self._profiles.append(profile)
+        return profile
+
+    def run(self, func, args, kwargs):
+        local = self._local
+        if getattr(local, 'enabled', False):
+            return func(*args, **kwargs)
+        profile = self._profiler()
+        try:
+            profile.enable()
+        except ValueError:
+            # since python 3.12 there is one profiler for all the threads, the one of the main thread sees this call
+            return func(*args, **kwargs)
+        local.enabled = True
+        try:
+            return func(*args, **kwargs)
+        finally:
+            profile.disable()
+            local.enabled = False
+
+
+def start(mode='sample'):
+    global _active
+    if _active is None:
+        _active = Profile(mode)
+        _active.start()
+        logger.info('profile %s started', mode)
+    return _active
+
+
+def stop():
+    global _active
+    if (profile := _active) is not None:
+        _active = None
+        return profile.stop()
+
+
+def toggle(mode='sample'):
+    """Start a profile or stop the active one, return the written file when stopped"""
+    if _active is None:
+        start(mode)
+        return None
+    return stop()
+
+
+def start_from_env():
+    if mode := os.environ.get(ENV):
+        if mode not in ('sample', 'cprofile'):
+            raise SystemExit(f'{ENV} must be sample or cprofile')
+        start(mode)
+        atexit.register(stop)
@@ -7,15 +7,37 @@ from PyQt6.QtGui import *
 from PyQt6.QtWebEngineCore import *
 from PyQt6.QtWebEngineWidgets import *
 from PyQt6.QtWidgets import *
-from PyQt6.sip import wrappertype
-
-for obj in tuple(globals().values()):
-    if isinstance(obj, wrappertype):
-        for attr in tuple(obj.__dict__.values()):
-            if isinstance(attr, EnumType):
-                for k, v in attr.__members__.items():
-                    if not hasattr(obj, k):
-                        setattr(obj, k, v)
+
+
+class EnumNamespace:
+    """Resolve unscoped enum members (Qt.UserRole for Qt.ItemDataRole.UserRole) on first access.
+
+    Promoting the members of every enum of every class at import time is a noticeable part of the startup time.
+    """
+
+    def __init__(self, cls):
+        self._cls = cls
+        self._members = None
+
+    def __getattr__(self, name):
+        try:
+            value = getattr(self._cls, name)
+        except AttributeError:
+            if self._members is None:
+                self._members = members = {}
+                for attr in tuple(self._cls.__dict__.values()):
+                    if isinstance(attr, EnumType):
+                        for k, v in attr.__members__.items():
+                            members.setdefault(k, v)
+            try:
+                value = self._members[name]
+            except KeyError:
+                raise AttributeError(f'{self._cls.__name__} has no attribute {name}') from None
+        setattr(self, name, value)  # cache on the instance so __getattr__ is not called again
+        return value
+
+
+Qt = EnumNamespace(Qt)
 
 Signal = pyqtSignal
 Slot = pyqtSlot
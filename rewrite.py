@@ -0,0 +1,72 @@
+"""Transform html pages before they are served.
+
+The rules remove what cannot work or is not wanted in the viewer: crossorigin on preloaded fonts, analytics scripts and
+connection hints to third parties. A document adds its own selectors with the `rewrite` param:
+
+    rewrite:
+      remove: ['.cookie-banner', 'iframe.video']
+
+and disables the stage with `rewrite: false`.
+"""
+
+import threading
+from collections import OrderedDict
+
+from . import utils
+from .format import schema
+
+VERSION = 1  # bump when the built-in rules change so that the cached pages are transformed again
+CACHE_SIZE = 64 << 20
+ENTRY_SIZE = 256  # charged for the key of every entry, the unchanged pages have no output
+
+REMOVE = (
+    'link[rel=preconnect]',
+    'link[rel=dns-prefetch]',
+    'script[src*="googletagmanager.com"]',
+    'script[src*="google-analytics.com"]',
+    'script[src*="plausible.io"]',
+    'script[src*="static.cloudflareinsights.com"]',
+    'script[src*="readthedocs-analytics"]',
+    'script[data-domain]',
+)
+
+
+class Rewriter:
+    """Rules of a document, the output is cached by the hash of the stored body so that each page is decoded and parsed once"""
+
+    _cache = OrderedDict()  # (content hash, rules) -> (transformed page, encoding) or None if unchanged, shared by all documents
+    _cache_size = 0
+    _lock = threading.Lock()
+
+    def __init__(self, params=None):
+        self.enabled = params is not False
+        params = params or {}
+        self.remove = REMOVE + tuple(params.get('remove', ()))
+        self.rules = (VERSION, self.remove)
+
+    def __call__(self, content, content_type=None, encoding=None):
+        """Transformed page in the encoding of content, content is only decoded when it is not cached"""
+        if not self.enabled or not content:
+            return content, encoding
+        # selectolax output is utf-8, leave pages in other encodings alone
+        if content_type and 'charset=' in content_type and 'utf-8' not in content_type.lower():
+            return content, encoding
+
+        key = (schema.content_hash(content, encoding), self.rules)
+        cls = Rewriter
+        with cls._lock:
+            if key in cls._cache:
+                cls._cache.move_to_end(key)
+                return cls._cache[key] or (content, encoding)
+
+        html = utils.fix_html(schema.decode(content, encoding), self.remove)
+        output = (schema.encode(html.encode('utf-8'), encoding), encoding) if html is not None else None
+
+        with cls._lock:
+            if key not in cls._cache:
+                cls._cache[key] = output
+                cls._cache_size += ENTRY_SIZE + (len(output[0]) if output else 0)
+                while cls._cache_size > CACHE_SIZE:
+                    old = cls._cache.popitem(last=False)[1]
+                    cls._cache_size -= ENTRY_SIZE + (len(old[0]) if old else 0)
+        return output or (content, encoding)
@@ -0,0 +1,199 @@
+"""Headless load benchmark of HttpServer against synthetic documents.
+
+Run as a module from the parent directory of the package, e.g.
+
+    python -m qdocviewer.scripts.benchmark --sizes 2k,64k,1m --clients 8 --output bench.json
+"""
+
+import argparse
+import http.client
+import os
+import random
+import shutil
+import sys
+import zipfile
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+from statistics import quantiles
+from time import perf_counter
+
+import icecream
+import orjson as json
+
+from .. import DOCS_DIR, utils
+from ..format import create_instance
+from ..server import HttpServer
+
+try:
+    import resource
+except ImportError:  # windows
+    resource = None
+
+FORMATS = ('directory', 'zipped', 'mirror')
+WORDS = 'the of module function class return value object type string list dict none import default argument parameter'.split()
+MIRROR_URL = 'https://bench.invalid/'
+
+
+def make_pages(count, size, seed=0):
+    """Generate html pages of roughly size bytes with text that compresses like real documentation"""
+    rnd = random.Random(seed)
+    pages = {}
+    for i in range(count):
+        head = f'<!DOCTYPE html><html><head><title>Page {i}</title></head><body><h1>Page {i}</h1><p>'.encode()
+        body = []
+        length = len(head)
+        while length < size:
+            word = rnd.choice(WORDS)
+            body.append(word)
+            length += len(word) + 1
+        pages[f'page/{i}.html'] = head + ' '.join(body).encode() + b'</p></body></html>'
+    return pages
+
+
+def generate(fmt, name, pages):
+    """Create a synthetic document of the given format and return its docs.yaml params"""
+    path = DOCS_DIR / name
+    shutil.rmtree(path, ignore_errors=True)
+    path.makedirs_p()
+    match fmt:
+        case 'directory':
+            for file, content in pages.items():
+                (path / file).parent.makedirs_p()
+                (path / file).write_bytes(content)
+            return {}
+        case 'zipped':
+            with zipfile.ZipFile(path / f'{name}.zip', 'w', zipfile.ZIP_DEFLATED) as zf:
+                for file, content in pages.items():
+                    zf.writestr(file, content)
+            return {'zip': f'{name}.zip'}
+        case 'mirror':
+            params = {'url': MIRROR_URL}
+            doc = create_instance(name, params, fmt)
+            updated = utils.epoch()
+            for file, content in pages.items():
+                doc._store(file, 200, {'content-type': 'text/html'}, content, updated)
+            doc.stop()
+            doc.writer.join()
+            return params
+
+
+def rss():
+    """Current and peak resident set size of this process in bytes"""
+    current = None
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmRSS:'):
+                    current = int(line.split()[1]) * 1024
+                    break
+    except OSError:
+        pass
+    peak = None
+    if resource:
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        if sys.platform != 'darwin':
+            peak *= 1024
+    return current, peak
+
+
+def run_client(port, paths, requests, keepalive, seed):
+    """Issue requests against the server and return the latency of each request, run in a worker process"""
+    rnd = random.Random(seed)
+    headers = {} if keepalive else {'Connection': 'close'}
+    latencies = []
+    errors = 0
+    conn = http.client.HTTPConnection('127.0.0.1', port)
+    for _ in range(requests):
+        path = rnd.choice(paths)
+        t = perf_counter()
+        try:
+            conn.request('GET', '/' + path, headers=headers)
+            r = conn.getresponse()
+            r.read()
+            if r.status != 200:
+                errors += 1
+        except (OSError, http.client.HTTPException):
+            errors += 1
+            conn.close()
+        latencies.append(perf_counter() - t)
+        if not keepalive:
+            conn.close()
+    conn.close()
+    return latencies, errors
+
+
+def bench(pool, fmt, name, params, paths, args, keepalive):
+    doc = create_instance(name, params, fmt)
+    server = HttpServer(doc)
+    server.start()
+    try:
+        per_client = max(1, args.requests // args.clients)
+        t = perf_counter()
+        futures = [pool.submit(run_client, server.server_port, paths, per_client, keepalive, args.seed + i) for i in range(args.clients)]
+        latencies = []
+        errors = 0
+        for future in futures:
+            lat, err = future.result()
+            latencies.extend(lat)
+            errors += err
+        elapsed = perf_counter() - t
+    finally:
+        server.stop()
+        doc.stop()
+
+    cuts = quantiles(latencies, n=100)
+    current, peak = rss()
+    return {
+        'requests': len(latencies),
+        'errors': errors,
+        'elapsed': elapsed,
+        'throughput': len(latencies) / elapsed,
+        'p50': cuts[49],
+        'p99': cuts[98],
+        'rss': current,
+        'peak_rss': peak,
+        'lookup': doc.metrics.summary('lookup'),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark HttpServer against synthetic documents')
+    parser.add_argument('-f', '--formats', default=','.join(FORMATS), help='Comma separated formats to benchmark')
+    parser.add_argument('-s', '--sizes', default='2k,64k,1m', help='Comma separated page body sizes')
+    parser.add_argument('-p', '--pages', type=int, default=200, help='Number of pages per document')
+    parser.add_argument('-c', '--clients', type=int, default=8, help='Number of concurrent clients')
+    parser.add_argument('-n', '--requests', type=int, default=2000, help='Total number of requests per run')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--keep', action='store_true', help='Keep the generated documents')
+    parser.add_argument('-o', '--output', help='JSON result file, default is data/bench-<timestamp>.json')
+    args = parser.parse_args()
+
+    icecream.install()
+
+    results = []
+    with ProcessPoolExecutor(args.clients) as pool:
+        for size_text in args.sizes.split(','):
+            size = utils.parse_size(size_text)
+            pages = make_pages(args.pages, size, args.seed)
+            paths = list(pages)
+            for fmt in args.formats.split(','):
+                name = f'__bench_{fmt}_{size_text}'
+                params = generate(fmt, name, pages)
+                try:
+                    for keepalive in (True, False):
+                        result = bench(pool, fmt, name, params, paths, args, keepalive)
+                        result.update(format=fmt, size=size, pages=args.pages, clients=args.clients, keepalive=keepalive)
+                        results.append(result)
+                        print(f'{fmt:10} {size_text:>5} {"keep-alive" if keepalive else "close":10} {result["throughput"]:9.1f} req/s  p50 {result["p50"] * 1000:7.2f}ms  p99 {result["p99"] * 1000:7.2f}ms  rss {(result["rss"] or 0) >> 20}MB  errors {result["errors"]}')
+                finally:
+                    if not args.keep:
+                        shutil.rmtree(DOCS_DIR / name, ignore_errors=True)
+
+    output = args.output or DOCS_DIR.parent / 'data' / f'bench-{datetime.now():%Y%m%d-%H%M%S}.json'
+    with open(output, 'wb') as f:
+        f.write(json.dumps({'date': datetime.now().isoformat(), 'platform': sys.platform, 'cpus': os.cpu_count(), 'results': results}, option=json.OPT_INDENT_2))
+    print('saved', output)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,194 @@
+"""Doc-open latency benchmark: from create_instance to a rendered page and a usable index, under an offscreen Qt.
+
+Each format is opened cold in a fresh process (imports, QApplication and the renderer included) then warm again in
+the same process. Run as a module from the parent directory of the package, e.g.
+
+    python -m qdocviewer.scripts.benchopen --pages 2000 --warm 5 --output open.json
+"""
+
+import argparse
+import os
+import shutil
+import subprocess
+import sys
+from datetime import datetime
+from statistics import median
+from time import perf_counter
+
+os.environ.setdefault('QT_QPA_PLATFORM', 'offscreen')
+
+import orjson as json
+
+from .. import APP_DIR, DATA_DIR, DOCS_DIR
+from .benchmark import FORMATS, MIRROR_URL, generate, make_pages
+
+TIMEOUT = 30_000
+START = 'page/0.html'
+
+
+def make_index(name, pages):
+    """index.json of the document, read by get_index for every format"""
+    symbols = [f'symbol_{i}' for i in range(len(pages))]
+    (DOCS_DIR / name / 'index.json').write_bytes(json.dumps([symbols, list(pages)]))
+
+
+def open_doc(fmt, name, params):
+    """Open the document like MainWindow does and return the time of each phase in seconds"""
+    from .. import qt
+    from ..format import create_instance
+    from ..server import HttpServer
+    from ..viewer import ViewerWidget
+
+    times = {}
+
+    def timed(key, func):
+        def wrapper(*args, **kwargs):
+            t = perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                times[key] = perf_counter() - t
+
+        return wrapper
+
+    start = perf_counter()
+    doc = timed('create_instance', create_instance)(name, params, fmt)
+    doc.get_index = timed('get_index', doc.get_index)
+
+    # the phases run inside the ViewerWidget constructor
+    server_start, create_index = HttpServer.start, ViewerWidget._create_index
+    HttpServer.start = timed('server_start', server_start)
+    ViewerWidget._create_index = timed('index_widget', create_index)
+    try:
+        viewer = timed('viewer', ViewerWidget)(doc)
+    finally:
+        HttpServer.start, ViewerWidget._create_index = server_start, create_index
+
+    loop = qt.QEventLoop()
+    marks = {}
+
+    def mark(key):
+        if key not in marks:
+            marks[key] = perf_counter() - start
+            if 'load_finished' in marks and 'first_paint' in marks:
+                loop.quit()
+
+    class FirstPaint(qt.QObject):
+        def eventFilter(self, obj, event):
+            if event.type() == qt.QEvent.Type.Paint:
+                mark('first_paint')
+            return False
+
+    viewer._page.loadFinished.connect(lambda ok: (times.setdefault('ok', ok), mark('load_finished')))
+    viewer.resize(1200, 800)
+    viewer.show()
+    # the page is painted by the render widget, the focus proxy of the view
+    target = viewer._webengine.focusProxy() or viewer._webengine
+    first_paint = FirstPaint(target)
+    target.installEventFilter(first_paint)
+    marks['index_ready'] = perf_counter() - start if viewer._index is not None else None
+
+    qt.QTimer.singleShot(TIMEOUT, loop.quit)
+    loop.exec()
+    target.removeEventFilter(first_paint)
+
+    times.update(marks)
+    times.setdefault('load_finished', None)
+    times.setdefault('first_paint', None)
+    times['total'] = max((v for v in marks.values() if v is not None), default=None)
+
+    viewer._cleanup()
+    viewer.deleteLater()
+    qt.QApplication.sendPostedEvents(None, qt.QEvent.Type.DeferredDelete)
+    if fmt == 'mirror':
+        doc.writer.join()
+    return times
+
+
+def child(fmt, name, params, warm):
+    """Cold then warm opens of one document, run in a fresh process"""
+    t = perf_counter()
+    from PyQt6.QtQuick import QQuickWindow, QSGRendererInterface
+
+    from .. import qt
+
+    # same as run_gui
+    QQuickWindow.setGraphicsApi(QSGRendererInterface.GraphicsApi.OpenGL)
+    app = qt.QApplication(sys.argv)
+    app_time = perf_counter() - t
+
+    runs = []
+    for i in range(warm + 1):
+        times = open_doc(fmt, name, params)
+        times['run'] = 'warm' if i else 'cold'
+        runs.append(times)
+    runs[0]['app'] = app_time
+    sys.stdout.buffer.write(json.dumps(runs) + b'\n')
+    sys.stdout.flush()
+    app.quit()
+
+
+def ms(value):
+    return '      -' if value is None else f'{value * 1000:7.1f}'
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the time to open a document in the viewer')
+    parser.add_argument('-f', '--formats', default=','.join(FORMATS), help='Comma separated formats to benchmark')
+    parser.add_argument('-p', '--pages', type=int, default=2000, help='Number of pages and index entries per document')
+    parser.add_argument('-s', '--size', type=int, default=16384, help='Page body size in bytes')
+    parser.add_argument('-w', '--warm', type=int, default=3, help='Number of warm opens after the cold open')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--keep', action='store_true', help='Keep the generated documents')
+    parser.add_argument('-o', '--output', help='JSON result file, default is data/benchopen-<timestamp>.json')
+    parser.add_argument('--child', nargs=3, metavar=('FORMAT', 'NAME', 'PARAMS'), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        fmt, name, params = args.child
+        child(fmt, name, json.loads(params), args.warm)
+        return
+
+    pages = make_pages(args.pages, args.size, args.seed)
+    phases = ('create_instance', 'server_start', 'get_index', 'index_widget', 'viewer', 'load_finished', 'first_paint')
+    print(f'{"":15}' + ''.join(f'{phase:>16}' for phase in phases))
+
+    results = []
+    for fmt in args.formats.split(','):
+        name = f'__benchopen_{fmt}'
+        params = generate(fmt, name, pages)
+        make_index(name, pages)
+        # the documents have no index.html
+        if fmt == 'mirror':
+            params['url'] = MIRROR_URL + START
+        else:
+            params['start'] = START
+        try:
+            out = subprocess.run(
+                [sys.executable, '-m', __spec__.name, '--child', fmt, name, json.dumps(params).decode(), '--warm', str(args.warm)],
+                cwd=APP_DIR.parent,
+                stdout=subprocess.PIPE,
+                check=True,
+            ).stdout
+            runs = json.loads(out.splitlines()[-1])
+        finally:
+            if not args.keep:
+                shutil.rmtree(DOCS_DIR / name, ignore_errors=True)
+
+        for run in runs:
+            run.update(format=fmt, pages=args.pages, size=args.size)
+            results.append(run)
+        rows = [('cold', runs[0])]
+        if warm := runs[1:]:
+            rows.append(('warm', {phase: median(values) if (values := [run[phase] for run in warm if run.get(phase) is not None]) else None for phase in phases}))
+        for label, row in rows:
+            print(f'{fmt:10} {label:4}' + ''.join(f'{ms(row.get(phase))}ms'.rjust(16) for phase in phases))
+
+    output = args.output or DATA_DIR / f'benchopen-{datetime.now():%Y%m%d-%H%M%S}.json'
+    with open(output, 'wb') as f:
+        f.write(json.dumps({'date': datetime.now().isoformat(), 'platform': sys.platform, 'cpus': os.cpu_count(), 'results': results}, option=json.OPT_INDENT_2))
+    print('saved', output)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,202 @@
+"""Export the cache of a mirror document to a read-only zipped document.
+
+The zstd and gzip blobs of the cache are copied into the zip file without recompression, brotli blobs are recompressed
+with zstd. Redirects and content types that cannot be guessed from the file name are kept in a manifest read by
+ZippedFormat.
+
+    python -m qdocviewer.scripts.exportmirror python --name python-snapshot
+"""
+
+import argparse
+import os
+import sqlite3
+import sys
+import zlib
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+from urllib.parse import urlparse
+from zipfile import ZIP_DEFLATED, ZipInfo
+
+import orjson as json
+import zstandard as zstd
+from tqdm import tqdm
+from zipfile_zstd import ZipFile
+
+from .. import DOCS_DIR, catalog, utils
+from ..format import schema
+from ..format.zipped import MANIFEST
+
+ZIP_ZSTANDARD = 93
+ZSTD_VERSION = 63  # minimum zip version to extract zstd entries
+CHUNK_SIZE = 500
+RAW_WRITE_VERSIONS = ((3, 11), (3, 12), (3, 13))
+
+SELECT = """
+select path, status, content_type, location, blob.content, updated, encoding
+from cache left join blob on blob.hash = cache.blob_hash
+where cache.rowid between ? and ? and status in (200, 301, 302, 307, 308)
+"""
+
+
+def entry_name(path):
+    path = path.lstrip('/')
+    if path == '' or path.endswith('/'):
+        path += 'index.html'
+    return path
+
+
+def gzip_header_size(content):
+    flags = content[3]
+    size = 10
+    if flags & 4:  # FEXTRA
+        size += 2 + int.from_bytes(content[size : size + 2], 'little')
+    if flags & 8:  # FNAME
+        size = content.index(b'\0', size) + 1
+    if flags & 16:  # FCOMMENT
+        size = content.index(b'\0', size) + 1
+    if flags & 2:  # FHCRC
+        size += 2
+    return size
+
+
+def zip_entry(content, encoding, cctx):
+    """Compression type, compressed entry and uncompressed data of a blob"""
+    match encoding:
+        case 'zstd':
+            return ZIP_ZSTANDARD, content, schema.decode(content, encoding)
+        case 'gzip':
+            # the deflate stream of a single member is a zip entry
+            d = zlib.decompressobj(31)
+            data = d.decompress(content)
+            if d.eof and not d.unused_data:
+                return ZIP_DEFLATED, content[gzip_header_size(content) : -8], data
+    data = schema.decode(content, encoding)
+    return ZIP_ZSTANDARD, cctx.compress(data), data
+
+
+def load_chunk(dbpath, first, last):
+    """Read the rows in a rowid range, decompress each blob once to get its crc and size, run in a worker process"""
+    conn = sqlite3.connect(f'file:{dbpath}?mode=ro', uri=True)
+    entries = []
+    redirects = []
+    cctx = zstd.ZstdCompressor()
+    for path, status, content_type, location, content, updated, encoding in conn.execute(SELECT, (first, last)):
+        if status != 200:
+            if location:
+                redirects.append((path, status, location))
+            continue
+        if content:
+            compress_type, blob, data = zip_entry(content, encoding, cctx)
+            entries.append((path, content_type, compress_type, blob, zlib.crc32(data), len(data), updated))
+        else:
+            entries.append((path, content_type, None, None, 0, 0, updated))
+    conn.close()
+    return entries, redirects
+
+
+class RawZipFile(ZipFile):
+    """ZipFile that also stores entries that are already compressed, zipfile only accepts uncompressed data.
+
+    This relies on the zipfile internals of the Python versions in RAW_WRITE_VERSIONS.
+    """
+
+    def __init__(self, *args, **kwargs):
+        if sys.version_info[:2] not in RAW_WRITE_VERSIONS:
+            raise SystemExit(f'exportmirror has not been checked against the zipfile module of Python {sys.version.split()[0]}')
+        super().__init__(*args, **kwargs)
+
+    def write_raw(self, info, blob):
+        """Write an entry whose compress_type, CRC and file_size are set to the compressed blob"""
+        with self._lock:
+            if self._writing:
+                raise ValueError("Can't write to the ZIP file while there is an open writing handle")
+            info.compress_size = len(blob)
+            self._writecheck(info)
+            self._didModify = True
+            self.fp.seek(self.start_dir)
+            info.header_offset = self.fp.tell()
+            self.fp.write(info.FileHeader())
+            self.fp.write(blob)
+            self.filelist.append(info)
+            self.NameToInfo[info.filename] = info
+            self.start_dir = self.fp.tell()
+
+
+def export(name, output_name, workers=None):
+    params = dict(catalog.walk(catalog.load_tree())).get(name)
+    if params is None or 'url' not in params:
+        raise SystemExit(f'{name} is not a mirror document')
+
+    url = urlparse(params['url'])
+    prefix = f'{url.scheme}://{url.hostname}'
+    dbpath = DOCS_DIR / name / 'cache.sqlite'
+
+    # the cache is only read, the workers expect the current schema
+    conn = sqlite3.connect(f'file:{dbpath}?mode=ro', uri=True)
+    version = schema.get_version(conn)
+    if version != schema.VERSION:
+        conn.close()
+        raise SystemExit(f'{dbpath} has schema version {version}, run python -m qdocviewer.scripts.upgradedb first')
+    first, last = conn.execute('select min(rowid), max(rowid) from cache').fetchone()
+    conn.close()
+    if first is None:
+        raise SystemExit(f'{dbpath} is empty')
+
+    output_dir = (DOCS_DIR / output_name).makedirs_p()
+    output = output_dir / f'{output_name}.zip'
+    assert not output.exists(), f'{output} already exists'
+
+    redirects = {}
+    content_types = {}
+    with ProcessPoolExecutor(workers) as pool, RawZipFile(output, 'w') as zf, tqdm(total=last - first + 1, unit='rows') as pb:
+        futures = [(i, pool.submit(load_chunk, dbpath, i, min(i + CHUNK_SIZE - 1, last))) for i in range(first, last + 1, CHUNK_SIZE)]
+        for i, future in futures:
+            entries, chunk_redirects = future.result()
+            for path, content_type, compress_type, blob, crc, size, updated in entries:
+                filename = entry_name(path)
+                if filename in zf.NameToInfo:
+                    continue
+                info = ZipInfo(filename, datetime.fromtimestamp(max(updated, 315532800)).timetuple()[:6])
+                info.external_attr = 0o644 << 16
+                if blob is None:
+                    zf.writestr(info, b'')
+                else:
+                    info.compress_type = compress_type
+                    if compress_type == ZIP_ZSTANDARD:
+                        info.create_version = info.extract_version = ZSTD_VERSION
+                    info.CRC = crc
+                    info.file_size = size
+                    zf.write_raw(info, blob)
+                if content_type and content_type.split(';', 1)[0].strip() != utils.guess_mime(filename):
+                    content_types[filename] = content_type
+            for path, status, location in chunk_redirects:
+                # redirects inside the site become root relative so that they are served by the snapshot
+                if location.startswith(prefix):
+                    location = location[len(prefix) :] or '/'
+                redirects[path.lstrip('/')] = (status, location)
+            pb.update(min(CHUNK_SIZE, last - i + 1))
+
+        zf.writestr(MANIFEST, json.dumps({'source': params['url'], 'redirects': redirects, 'content_types': content_types}))
+
+    entry = {'zip': output.name, 'start': url.path or '/'}
+    for key in ('index', 'whitelist'):
+        if key in params:
+            entry[key] = params[key]
+    print(f'Exported {len(zf.filelist) - 1} files and {len(redirects)} redirects to {output}, add to docs.yaml:\n')
+    print(f'{output_name}:')
+    for key, value in entry.items():
+        print(f'  {key}: {json.dumps(value).decode()}')
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Export a mirror document to a zipped document')
+    parser.add_argument('doc', help='Name of the mirror document in docs.yaml')
+    parser.add_argument('-n', '--name', help='Name of the new document, default is <doc>-snapshot')
+    parser.add_argument('-w', '--workers', type=int, default=os.cpu_count(), help='Number of worker processes')
+    args = parser.parse_args()
+
+    export(args.doc, args.name or f'{args.doc}-snapshot', args.workers)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,50 +1,46 @@
-import sqlite3
+"""Migrate every mirror cache.sqlite to the current schema in parallel.
 
-from path import Path
+Databases that do not use auto_vacuum=incremental yet are rebuilt once so that evicted rows can be reclaimed in
+small steps by the viewer.
 
+    python -m qdocviewer.scripts.upgradedb [--vacuum]
+"""
 
-class DB:
-    def __init__(self, conn):
-        self.conn = conn
-        self.curr = conn.cursor()
+import argparse
+import os
+from concurrent.futures import ProcessPoolExecutor
 
-    def execute(self, query, params=()):
-        return self.curr.execute(query, params)
+from .. import DOCS_DIR, sqlite
+from ..format import schema
 
-    def get_one(self, query, params=()):
-        self.curr.execute(query, params)
-        row = self.curr.fetchone()
-        if row:
-            return row[0]
 
-    def get_row(self, query, params=()):
-        self.curr.execute(query, params)
-        return self.curr.fetchone()
+def upgrade(file, vacuum=False):
+    conn = sqlite.connect(file, autocommit=True)
+    try:
+        old, new = schema.migrate(conn, file)
+        if not schema.enable_incremental_vacuum(conn) and vacuum:
+            conn.execute('vacuum')
+    finally:
+        conn.close()
+    return old, new
 
-    def get_all(self, query, params=()):
-        self.curr.execute(query, params)
-        return self.curr.fetchall()
 
-    def has_column(self, table, column):
-        for row in self.get_all(f"pragma table_info('{table}')"):
-            if row[1] == column:
-                return True
-        return False
+def main():
+    parser = argparse.ArgumentParser(description='Migrate the mirror caches to the current schema')
+    parser.add_argument('--vacuum', action='store_true', help='Rebuild the databases after the migration')
+    parser.add_argument('-w', '--workers', type=int, default=os.cpu_count(), help='Number of worker processes')
+    args = parser.parse_args()
 
-    def close(self):
-        self.conn.close()
+    files = [file for file in DOCS_DIR.walkfiles('cache.sqlite')]
+    with ProcessPoolExecutor(args.workers) as pool:
+        futures = {file: pool.submit(upgrade, file, args.vacuum) for file in files}
+        for file, future in futures.items():
+            try:
+                old, new = future.result()
+                print(file, f'{old} -> {new}' if old != new else new)
+            except Exception as err:
+                print(file, 'failed:', err)
 
 
-for file in Path('docs').walkfiles():
-    if file.name == 'cache.sqlite':
-        print(file)
-        db = DB(sqlite3.connect(file, autocommit=True))
-
-        # v2
-        # if not db.has_column('cache', 'updated'):
-        #     db.execute('alter table cache rename column created to updated')
-        # if not db.has_column('cache', 'refresh'):
-        #     db.execute('alter table cache add column refresh integer default 0 not null')
-
-        db.execute('vacuum')
-        db.close()
+if __name__ == '__main__':
+    main()
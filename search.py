@@ -0,0 +1,84 @@
+"""Page search on the inverted index of a Sphinx searchindex.js.
+
+The terms and titleterms map a stemmed word to the pages containing it. A query word matches the terms equal to it,
+the terms it starts with (the stem of the word) and the terms starting with it (a word being typed). The pages
+matching every word are ranked like searchtools.js: a title match counts more than a body match, an exact match more
+than a partial one.
+"""
+
+import re
+
+import polars as pl
+
+from . import utils
+
+MAX_RESULT = 50
+TITLE_SCORE = 15
+TERM_SCORE = 5
+PARTIAL_RATIO = 0.4
+MIN_STEM = 3
+ws_re = re.compile(r'\W+')
+
+
+class SearchIndex:
+    def __init__(self, data, base_url='/'):
+        docnames, add_html = utils.searchindex_pages(data)
+        locations = [f'{name}.html' for name in docnames] if add_html else docnames
+        self._pages = utils.resolve_locations(
+            pl.DataFrame({'page': range(len(docnames)), 'symbol': data['titles'], 'location': locations}, schema={'page': pl.UInt32, 'symbol': pl.String, 'location': pl.String}),
+            base_url,
+        )
+
+        # postings are kept as one list column per term, only the terms matching a query are exploded
+        terms = []
+        pages = []
+        scores = []
+        for key, score in (('terms', TERM_SCORE), ('titleterms', TITLE_SCORE)):
+            for term, docs in data.get(key, {}).items():
+                terms.append(term)
+                pages.append([docs] if isinstance(docs, int) else docs)
+                scores.append(score)
+        self._terms = pl.DataFrame({'term': terms, 'pages': pages, 'score': scores}, schema={'term': pl.String, 'pages': pl.List(pl.UInt32), 'score': pl.Float32})
+
+    @classmethod
+    def load(cls, content, base_url='/'):
+        if (data := utils.load_searchindex(content)) is not None and 'terms' in data:
+            return cls(data, base_url)
+
+    def __len__(self):
+        return len(self._pages)
+
+    def search(self, text, limit=MAX_RESULT):
+        """symbol (page title) and location of the best pages containing every word"""
+        words = [word for word in ws_re.split(text.lower()) if word]
+        if not words:
+            return self._pages.head(0).select('symbol', 'location')
+
+        term = pl.col.term
+        matches = []
+        for i, word in enumerate(words):
+            exact = term == word
+            stem = pl.lit(word).str.starts_with(term) & (term.str.len_chars() >= MIN_STEM)
+            matches.append(
+                self._terms.lazy()
+                .filter(exact | stem | term.str.starts_with(word))
+                .with_columns(score=pl.when(exact).then(pl.col.score).otherwise(pl.col.score * PARTIAL_RATIO))
+                .explode('pages')
+                .rename({'pages': 'page'})
+                .group_by('page')
+                .agg(pl.col.score.max())
+                .with_columns(word=pl.lit(i, dtype=pl.UInt32))
+            )
+
+        # pages matched by every word, the best match of each word is summed
+        return (
+            pl.concat(matches)
+            .group_by('page')
+            .agg(pl.col.score.sum(), pl.col.word.n_unique().alias('words'))
+            .filter(pl.col.words == len(words))
+            .join(self._pages.lazy(), on='page')
+            .sort(['score', 'symbol'], descending=[True, False])
+            .head(limit)
+            .select('symbol', 'location')
+            .collect()
+        )
@@ -0,0 +1,128 @@
+import argparse
+import html
+import logging
+import socket
+import threading
+from http import HTTPStatus
+from http.server import ThreadingHTTPServer
+from urllib.parse import urlparse
+
+import orjson as json
+
+from . import catalog
+from .format import create_instance, get_format
+from .server import STATS_PATH, RequestHandler
+
+logger = logging.getLogger(__name__)
+
+
+class DocsRequestHandler(RequestHandler):
+    """Serve every document of docs.yaml under /<name>/"""
+
+    def _route(self):
+        server = self.server
+        path = urlparse(self.path).path
+        if path == '/':
+            self._send_index()
+            return None, None, None
+        if path == STATS_PATH:
+            self._send_content(json.dumps({name: doc.metrics.snapshot() for name, doc in server.instances.items()}, option=json.OPT_INDENT_2), type='application/json')
+            return None, None, None
+
+        name, slash, _ = path[1:].partition('/')
+        if name not in server.docs:
+            # root relative link inside a document, resolve it against the document of the referring page
+            if (referer := self.headers.get('Referer')) and (ref := urlparse(referer).path[1:].partition('/')[0]) in server.docs:
+                self._send_redirect(f'/{ref}{self.path}')
+            else:
+                self._send_content(f'Document {name} not found', status=HTTPStatus.NOT_FOUND)
+            return None, None, None
+
+        doc = server.get_doc(name)
+        mount = f'/{name}/'
+        if not slash:
+            self._send_redirect(mount + doc.start.lstrip('/') if doc.start else mount)
+            return None, None, None
+
+        request_path = self.path[len(mount) - 1 :]
+        if request_path.startswith('/https://') or request_path.startswith('/http://'):
+            # the viewer blocks other hosts in its request interceptor, do it here for the browsers
+            if not doc.is_whitelisted(urlparse(request_path[1:]).hostname):
+                self._send_content(f'{request_path[1:]} is not whitelisted', status=HTTPStatus.FORBIDDEN)
+                return None, None, None
+
+        return doc, mount, request_path
+
+    def _send_index(self):
+        links = ''.join(f'<li><a href="/{html.escape(name)}">{html.escape(name)}</a> <small>{fmt}</small></li>' for name, (_, fmt) in self.server.docs.items())
+        self._send_content(f'<!DOCTYPE html><html><head><title>Documents</title></head><body><ul>{links}</ul></body></html>', type='text/html')
+
+
+class DocsServer(ThreadingHTTPServer):
+    """A thread per connection, a keep-alive connection waiting for its next request only holds its own thread"""
+
+    daemon_threads = True
+
+    def __init__(self, address, docs):
+        self.docs = docs  # name -> (params, format)
+        self.instances = {}  # documents are created on the first request
+        self._lock = threading.Lock()
+        self._connections = set()  # sockets of the open connections, shut down by stop
+        super().__init__(address, DocsRequestHandler)
+
+    def process_request(self, request, client_address):
+        with self._lock:
+            self._connections.add(request)
+        super().process_request(request, client_address)
+
+    def shutdown_request(self, request):
+        with self._lock:
+            self._connections.discard(request)
+        super().shutdown_request(request)
+
+    def get_doc(self, name):
+        if (doc := self.instances.get(name)) is None:
+            with self._lock:
+                if (doc := self.instances.get(name)) is None:
+                    params, fmt = self.docs[name]
+                    logger.info('open %s (%s)', name, fmt)
+                    doc = self.instances[name] = create_instance(name, params, fmt)
+        return doc
+
+    def stop(self):
+        self.server_close()
+        # wakes the threads blocked on the next request of an idle connection
+        with self._lock:
+            connections = list(self._connections)
+        for request in connections:
+            try:
+                request.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+        for doc in self.instances.values():
+            doc.stop()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='qdocviewer serve', description='Serve the documents of docs.yaml without the viewer')
+    parser.add_argument('--host', default='127.0.0.1', help='Address to listen on, use 0.0.0.0 to share with other machines')
+    parser.add_argument('-p', '--port', type=int, default=8000)
+    parser.add_argument('docs', nargs='*', help='Only serve these documents')
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(message)s')
+
+    docs = {}
+    for name, params in catalog.walk(catalog.load_tree()):
+        if not args.docs or name in args.docs:
+            docs[name] = (params, get_format(name, params))
+
+    server = DocsServer((args.host, args.port), docs)
+    print(f'Serving {len(docs)} documents on http://{args.host}:{server.server_port}/')
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.stop()
+    return 0
@@ -1,69 +1,127 @@
 from http import HTTPStatus
 from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
 from threading import Thread
+from time import perf_counter
 from urllib.parse import urlparse
 
-from . import mime_db, qt
+import orjson as json
+
+from . import utils
+from .format import schema
+from .metrics import SIZE_BUCKETS
+from .profiler import profiled
+
+STATS_PATH = '/__stats'
 
 
 class RequestHandler(BaseHTTPRequestHandler):
+    # keep-alive, every response has a Content-Length
+    protocol_version = 'HTTP/1.1'
+    timeout = 60  # an idle keep-alive connection holds its handler thread until then
+    # headers and body are separate writes, nagle would delay the body of a small response by the delayed ack
+    disable_nagle_algorithm = True
+
+    @profiled
     def do_GET(self):
-        doc = self.server.doc
-        if self.path.startswith('/https://') or self.path.startswith('/http://'):
-            path = self.path.lstrip('/')
+        doc, mount, request_path = self._route()
+        if doc is None:
+            return
+
+        if request_path.split('?', 1)[0] == STATS_PATH:
+            self._send_stats(doc)
+            return
+
+        t = doc.last_request = perf_counter()
+        if request_path.startswith('/https://') or request_path.startswith('/http://'):
+            path = request_path.lstrip('/')
         else:
-            path = urlparse(self.path).path.lstrip('/')  # remove query from path
+            path = urlparse(request_path).path.lstrip('/')  # remove query from path
 
         if not doc.format == 'mirror' and path == '':
             path = 'index.html'
 
         try:
-            item = doc[path]
+            with doc.metrics.time('lookup'):
+                item = doc[path]
         except KeyError:
             ic('not found', path)
             self._send_content(f'Path {path} not found in {doc.path}', status=HTTPStatus.NOT_FOUND)
             return
 
         status = item.status or HTTPStatus.OK
-        mime = item.content_type or mime_db.mimeTypeForFile(item.name, qt.QMimeDatabase.MatchMode.MatchExtension).name()
+        mime = item.content_type or utils.guess_mime(item.name)
+        content, encoding = item.content, item.encoding
+        html = status == HTTPStatus.OK and mime.startswith('text/html')
+        if html:
+            # a rewritten page is cached in the encoding of the stored body
+            with doc.metrics.time('rewrite'):
+                content, encoding = doc.rewriter(content, mime, encoding)
+
+        # a stored body is sent as is to a client accepting its encoding
+        if encoding and encoding not in utils.accepted_encodings(self.headers.get('Accept-Encoding')):
+            with doc.metrics.time('decode'):
+                content, encoding = schema.decode(content, encoding), None
 
         self.send_response(status)
         self.send_header('Content-Type', mime)
-        self.send_header('Content-Length', len(item.content))
+        self.send_header('Content-Length', len(content))
+        if encoding:
+            self.send_header('Content-Encoding', encoding)
+            self.send_header('Vary', 'Accept-Encoding')
         self.send_header('Access-Control-Allow-Origin', '*')
-        if status in (301, 302):
-            self.send_header('Location', self._fix_redirect(item.location, doc))
+        if 300 <= status < 400 and item.location:
+            self.send_header('Location', self._fix_redirect(item.location, doc, mount))
         elif status == 200:
             self.send_header('Cache-Control', 'max-age=604800')  # make js/css cached by the client
         self.end_headers()
 
-        self.wfile.write(item.content)
+        self.wfile.write(content)
+
+        doc.metrics.observe('bytes', len(content), SIZE_BUCKETS)
+        doc.metrics.observe('request', perf_counter() - t)
+
+        if html and not path.startswith('http'):
+            doc.prefetch(path, item)
 
     # disable request logging
     def log_message(self, format, *args):
         pass
 
+    def _route(self):
+        """Return the document, the path it is mounted on and the request path relative to the mount"""
+        return self.server.doc, '/', self.path
+
     def _send_content(self, content, status=HTTPStatus.OK, type='text/plain'):
         if isinstance(content, str):
             content = content.encode('utf-8')
-        self.send_response(HTTPStatus.OK)
+        self.send_response(status)
         self.send_header('Content-Type', type)
         self.send_header('Content-Length', len(content))
         self.end_headers()
         self.wfile.write(content)
 
-    def _fix_redirect(self, url, doc):
+    def _send_redirect(self, location, status=HTTPStatus.FOUND):
+        self.send_response(status)
+        self.send_header('Location', location)
+        self.send_header('Content-Length', 0)
+        self.end_headers()
+
+    def _send_stats(self, doc):
+        stats = {'name': doc.name, 'format': doc.format, **doc.metrics.snapshot()}
+        self._send_content(json.dumps(stats, option=json.OPT_INDENT_2), type='application/json')
+
+    def _fix_redirect(self, url, doc, mount='/'):
         # redirect without domain
         if url.startswith('/'):
-            return url
+            return mount + url[1:]
 
         # redirect with same domain
-        if url.startswith(doc.prefix):
-            assert doc.prefix[-1] == '/'
-            return url[len(doc.prefix) - 1 :]
+        if doc.format == 'mirror' and url.startswith(doc.prefix):
+            return mount + url[len(doc.prefix) :].lstrip('/')
 
+        # external resources are served under the mount point
         if url.startswith('http://') or url.startswith('https://'):
-            return self.server.prefix + url
+            return mount + url
 
         raise Exception('Invalid redirect: ' + url)
 
@@ -72,7 +130,7 @@ class HttpServer(ThreadingHTTPServer):
     def __init__(self, doc):
         super().__init__(('127.0.0.1', 0), RequestHandler)
         self.doc = doc  # used by RequestHandler
-        self.thread = Thread(target=self.serve_forever)
+        self.thread = Thread(target=self.serve_forever, name=f'http-{doc.name}')
 
     @property
     def prefix(self):
@@ -2,6 +2,22 @@ from . import Qt, format, qt
 from .viewer import ViewerWidget
 
 
+class Placeholder(qt.QLabel):
+    """A document of the previous session, the viewer is only created when it is activated"""
+
+    def __init__(self, data, path=None):
+        super().__init__(f'Opening {data[0]}...')
+        self.setAlignment(Qt.AlignCenter)
+        self._data = data
+        self._path = path
+
+    def _current_path(self):
+        return self._path
+
+    def _cleanup(self):
+        pass
+
+
 class StackWidget(qt.QStackedWidget):
     _title_changed = qt.Signal(str)
     _url_changed = qt.Signal(qt.QUrl)
@@ -11,29 +27,51 @@ class StackWidget(qt.QStackedWidget):
     def __init__(self, parent=None):
         super().__init__(parent)
 
-        self._viewers = {}
+        self._viewers = {}  # name -> ViewerWidget or Placeholder
         self._page_titles = {}
 
-    def _open(self, data):
-        id, name, params, fmt = data
+    def _open(self, data, path=None):
+        name, params, fmt = data
 
-        if id not in self._viewers:
-            doc = format.create_instance(name, params, fmt)
-            viewer = ViewerWidget(doc)
-            index = self.count()
+        viewer = self._viewers.get(name)
+        if isinstance(viewer, Placeholder):
+            placeholder = viewer
+            viewer = self._create_viewer(data, placeholder._path)
+            self.insertWidget(self.indexOf(placeholder), viewer)
+            self.removeWidget(placeholder)
+            placeholder.deleteLater()
+        elif viewer is None:
+            viewer = self._create_viewer(data, path)
             self.addWidget(viewer)
-            self._viewers[id] = index
-
-            @viewer._page.titleChanged
-            def _(title):
-                self._page_titles[index] = title
-                if index == self.currentIndex():
-                    self._title_changed.emit(title)
-            viewer._page.urlChanged.connect(self._url_changed)
-            viewer._page.loadFinished.connect(self._load_finished)
-        else:
-            index = self._viewers[id]
-
-        self.setCurrentIndex(index)
-        self._doc_changed.emit(self.currentWidget()._doc)
-        self.currentWidget().setFocus(Qt.MouseFocusReason)
+
+        self.setCurrentWidget(viewer)
+        self._doc_changed.emit(viewer._doc)
+        viewer.setFocus(Qt.MouseFocusReason)
+
+    def _add_placeholder(self, data, path=None):
+        name = data[0]
+        if name not in self._viewers:
+            self._viewers[name] = placeholder = Placeholder(data, path)
+            self.addWidget(placeholder)
+
+    def _create_viewer(self, data, path):
+        name, params, fmt = data
+        doc = format.create_instance(name, params, fmt)
+        self._viewers[name] = viewer = ViewerWidget(doc, path)
+
+        @viewer._page.titleChanged
+        def _(title):
+            self._page_titles[name] = title
+            if viewer is self.currentWidget():
+                self._title_changed.emit(title)
+        viewer._page.urlChanged.connect(self._url_changed)
+        viewer._page.loadFinished.connect(self._load_finished)
+        return viewer
+
+    def _session(self):
+        """Names and current paths of the open documents, and the name of the active one"""
+        docs = [(name, viewer._current_path()) for name, viewer in self._viewers.items()]
+        active = None
+        if viewer := self.currentWidget():
+            active = viewer._doc.name if isinstance(viewer, ViewerWidget) else viewer._data[0]
+        return {'docs': docs, 'active': active}
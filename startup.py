@@ -0,0 +1,64 @@
+import builtins
+import sys
+from time import perf_counter
+
+# modules that should not be loaded before the first paint
+HEAVY_MODULES = ('polars', 'httpx', 'lxml', 'selectolax', 'zstandard', 'yaml', 'icecream', 'pygments')
+
+
+class StartupProfile:
+    """Time the imports and the initialization phases until the main window is painted, enabled by --profile-startup"""
+
+    def __init__(self):
+        self.start = perf_counter()
+        self.phases = []
+        self.imports = {}  # module -> self time of its first import
+        self._last = self.start
+        self._stack = []
+        self._import = None
+
+    def install(self):
+        self._import = builtins.__import__
+        builtins.__import__ = self._timed_import
+
+    def uninstall(self):
+        if self._import is not None:
+            builtins.__import__ = self._import
+            self._import = None
+
+    def _timed_import(self, name, globals=None, locals=None, fromlist=(), level=0):
+        count = len(sys.modules)
+        t = perf_counter()
+        self._stack.append(0)
+        try:
+            return self._import(name, globals, locals, fromlist, level)
+        finally:
+            elapsed = perf_counter() - t
+            children = self._stack.pop()
+            if self._stack:
+                self._stack[-1] += elapsed
+            if len(sys.modules) != count:
+                if level and globals:
+                    package = globals.get('__package__') or ''
+                    if level > 1:
+                        package = package.rsplit('.', level - 1)[0]
+                    key = f'{package}.{name}' if name else f'{package}.{",".join(fromlist)}'
+                else:
+                    key = name.split('.', 1)[0]
+                self.imports[key] = self.imports.get(key, 0) + elapsed - children
+
+    def mark(self, phase):
+        t = perf_counter()
+        self.phases.append((phase, t - self._last))
+        self._last = t
+
+    def report(self, limit=20):
+        self.uninstall()
+        print(f'startup {perf_counter() - self.start:.3f}s')
+        for phase, elapsed in self.phases:
+            print(f'  {phase:30} {elapsed:8.3f}s')
+        print('imports (self time)')
+        for key, elapsed in sorted(self.imports.items(), key=lambda x: -x[1])[:limit]:
+            print(f'  {key:30} {elapsed:8.3f}s')
+        if loaded := [name for name in HEAVY_MODULES if name in sys.modules]:
+            print('loaded before first paint:', ', '.join(loaded))
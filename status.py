@@ -1,6 +1,7 @@
 from datetime import datetime
 
-from . import qt
+from . import memory, qt
+from .server import STATS_PATH
 
 
 class StatusBar(qt.QStatusBar):
@@ -46,11 +47,18 @@ class StatusBar(qt.QStatusBar):
 
     def _update_counter(self):
         if viewer := self.parent()._stack.currentWidget():
-            doc = viewer._doc
-            if hasattr(doc, 'counter'):
-                counter = doc.counter
-                texts = []
-                for k, color in {'fetch': '#63C885', 'cache': '#6AB3E7', 'block': '#FF8C8C', 'refresh': '#BDA434'}.items():
-                    if counter[k]:
-                        texts.append(f'<span style="color:{color}">{k.upper()}</span> {counter[k]}')
-                self._counter.setText(' '.join(texts))
+            metrics = viewer._doc.metrics
+            counter = metrics.counter
+            texts = []
+            for k, color in {'fetch': '#63C885', 'cache': '#6AB3E7', 'memory': '#9A8CE0', 'block': '#FF8C8C', 'refresh': '#BDA434'}.items():
+                if counter[k]:
+                    texts.append(f'<span style="color:{color}">{k.upper()}</span> {counter[k]}')
+            if lookup := metrics.summary('lookup'):
+                texts.append(f'<span style="color:#A0A0A0">LOOKUP</span> {lookup["p50"] * 1000:g}/{lookup["p99"] * 1000:g}ms')
+            if (ratio := metrics.hit_ratio()) is not None:
+                texts.append(f'<span style="color:#A0A0A0">HIT</span> {ratio:.0%}')
+            self._counter.setText(' '.join(texts))
+            self._counter.setToolTip(f'{viewer._prefix.rstrip("/")}{STATS_PATH}')
+
+    def _show_memory(self, report, process):
+        self.showMessage(f'MEMORY {report["name"]}: {memory.summary(report)} | process {memory.format_size(process["rss"])} threads {process["threads"]}', 15000)
@@ -1,8 +1,6 @@
-import yaml
-from path import Path
-
-from . import ICONS_DIR, Qt, qt
+from . import ICONS_DIR, Qt, catalog, qt
 from .format import get_format
+from .watcher import get_watcher
 
 SELECTED_BG = '#2468AB'
 GROUP_ICON = qt.QIcon(ICONS_DIR / 'group.png')
@@ -10,6 +8,139 @@ GROUP_ICON = qt.QIcon(ICONS_DIR / 'group.png')
 icons_cache = {}
 
 
+def get_icon(format):
+    global icons_cache
+    if format not in icons_cache:
+        icons_cache[format] = qt.QIcon(ICONS_DIR / f'{format}.png')
+    return icons_cache[format]
+
+
+class Node:
+    """A group or a document of docs.yaml, the children are only created when the view asks for them"""
+
+    __slots__ = ('label', 'params', 'parent', 'row', '_nodes', '_children', '_format')
+
+    def __init__(self, node, parent, row):
+        self.label, self.params, self._nodes = node
+        self.parent = parent
+        self.row = row
+        self._children = None
+        self._format = None
+
+    def __len__(self):
+        return len(self._nodes)
+
+    @property
+    def children(self):
+        if self._children is None:
+            self._children = [Node(node, self, i) for i, node in enumerate(self._nodes)]
+        return self._children
+
+    @property
+    def format(self):
+        if self._format is None and self.params is not None:
+            self._format = get_format(self.label, self.params)
+        return self._format
+
+    @property
+    def data(self):
+        if self.params is not None:
+            return (self.label, self.params, self.format)
+
+
+def document_paths(nodes, paths=None, path=()):
+    """Rows leading to each document of the tree, the first one of a name is kept"""
+    if paths is None:
+        paths = {}
+    for row, (label, params, children) in enumerate(nodes):
+        if params is not None:
+            paths.setdefault(label, path + (row,))
+        document_paths(children, paths, path + (row,))
+    return paths
+
+
+class Model(qt.QAbstractItemModel):
+    """The rows of a node are only inserted when the view expands it"""
+
+    def __init__(self, tree):
+        super().__init__()
+        self._set_root(tree)
+
+    def _set_root(self, tree):
+        self._root = Node(('', None, tree), None, 0)
+        self._root.children  # the top level is always shown
+        self._paths = document_paths(tree)
+
+    def _set_tree(self, tree):
+        self.beginResetModel()
+        self._set_root(tree)
+        self.endResetModel()
+
+    def _node(self, index):
+        return index.internalPointer() if index.isValid() else self._root
+
+    def index(self, row, column, parent):
+        if 0 <= row < self.rowCount(parent) and column == 0:
+            return self.createIndex(row, column, self._node(parent)._children[row])
+        return qt.QModelIndex()
+
+    def parent(self, index):
+        if index.isValid():
+            parent = index.internalPointer().parent
+            if parent is not self._root:
+                return self.createIndex(parent.row, 0, parent)
+        return qt.QModelIndex()
+
+    def rowCount(self, parent):
+        if parent.column() > 0:
+            return 0
+        node = self._node(parent)
+        return 0 if node._children is None else len(node._children)
+
+    def hasChildren(self, parent):
+        return parent.column() <= 0 and len(self._node(parent)) > 0
+
+    def canFetchMore(self, parent):
+        node = self._node(parent)
+        return node._children is None and len(node) > 0
+
+    def fetchMore(self, parent):
+        if self.canFetchMore(parent):
+            node = self._node(parent)
+            self.beginInsertRows(parent, 0, len(node) - 1)
+            node.children
+            self.endInsertRows()
+
+    def columnCount(self, parent):
+        return 1
+
+    def flags(self, index):
+        if index.isValid() and index.internalPointer().params is not None:
+            return Qt.ItemIsEnabled | Qt.ItemIsSelectable
+        return Qt.ItemIsEnabled
+
+    def data(self, index, role):
+        node = index.internalPointer()
+        match role:
+            case Qt.DisplayRole:
+                return node.label
+            case Qt.DecorationRole:
+                return GROUP_ICON if node.params is None else get_icon(node.format)
+            case Qt.ForegroundRole:
+                if node.params is None:
+                    return qt.QBrush(Qt.lightGray)
+            case Qt.UserRole:
+                return node.data
+
+    def _find(self, name):
+        """Index of the document with the given name, the rows of its ancestors are inserted"""
+        index = qt.QModelIndex()
+        for row in self._paths.get(name, ()):
+            self.fetchMore(index)
+            index = self.index(row, 0, index)
+        return index
+
+
 class Delegate(qt.QStyledItemDelegate):
     def paint(self, painter, option, index):
         if index == self.parent().currentIndex():
@@ -22,15 +153,17 @@ class Delegate(qt.QStyledItemDelegate):
         super().paint(painter, option, index)
 
 
-class TreeWidget(qt.QTreeWidget):
+class TreeWidget(qt.QTreeView):
     _letter_pressed = qt.Signal(str)
+    _doc_clicked = qt.Signal(object)
 
     def __init__(self, parent=None):
         super().__init__(parent)
         self.setFocusPolicy(Qt.NoFocus)
         self.setUniformRowHeights(True)
         self.setHeaderHidden(True)
-        self.setRootIsDecorated(False)
+        # the groups below the top level and the documents with children are expanded on demand
+        self.setRootIsDecorated(True)
         self.setItemDelegate(Delegate(self))
         self.header().setSectionResizeMode(0, qt.QHeaderView.ResizeMode.ResizeToContents)
         self.header().setStretchLastSection(False)
@@ -38,25 +171,36 @@ class TreeWidget(qt.QTreeWidget):
         self.setMouseTracking(True)
         self.setStyleSheet(
             """
-            QTreeWidget::item { border: 0; padding: 2px 10px; }
-            QTreeWidget::item:hover { border: 0; background: '%s' }
-            QTreeView::branch {  border-image: url(none.png) }
+            QTreeView::item { border: 0; padding: 2px 10px; }
+            QTreeView::item:hover { border: 0; background: '%s' }
         """
             % SELECTED_BG
         )
 
-        self._id = 0  # next_id counter
-        self._start_item = None  # item to open on application start
-        with (Path(__file__).parent / 'docs' / 'docs.yaml').open() as f:
-            self._load(yaml.load(f, Loader=yaml.CLoader), self)
-        self.expandAll()
+        self._model = model = Model(catalog.load_tree())
+        self.setModel(model)
+        self.expandToDepth(0)
+
+        self.clicked.connect(self._on_clicked)
 
-    def _next_id(self):
-        self._id += 1
-        return self._id
+        # reload docs.yaml when it is edited
+        self._watch = get_watcher().watch([catalog.DOCS_FILE], self._reload, parent=self)
+
+    @property
+    def _start_index(self):
+        # document to open on application start
+        return self._model._find('python')
+
+    def currentChanged(self, current, previous):
+        super().currentChanged(current, previous)
+        # a document selected by _find can be in a collapsed group
+        parent = current.parent()
+        while parent.isValid():
+            self.expand(parent)
+            parent = parent.parent()
 
     def mouseMoveEvent(self, event):
-        if self.indexAt(event.pos()).isValid() and self.itemAt(event.pos()).data(0, Qt.UserRole) is not None:
+        if self.indexAt(event.pos()).data(Qt.UserRole) is not None:
             self.setCursor(Qt.PointingHandCursor)
         else:
             self.setCursor(Qt.ArrowCursor)
@@ -72,37 +216,24 @@ class TreeWidget(qt.QTreeWidget):
     #     s = super().sizeHint()
     #     return qt.QSize(s.width() + 10, s.height())
 
-    def _load(self, items, parent):
-        for name, params in items.items():
-            if params is None:
-                params = {}
-
-            if name[0] == '.':
-                item = self._add_group(name[1:], parent)
-                self._load(params, item)
-            else:
-                format = get_format(name, params)
-                item = self._add_item(name, params, format, parent)
-                children = params.pop('children', None)
-                if children:
-                    self._load(children, item)
-
-    def _add_group(self, label, parent):
-        item = qt.QTreeWidgetItem(parent)
-        item.setText(0, label)
-        item.setFlags(Qt.ItemIsEnabled)
-        item.setForeground(0, qt.QBrush(Qt.lightGray))
-        item.setIcon(0, GROUP_ICON)
-        return item
-
-    def _add_item(self, name, params, format, parent):
-        global icons_cache
-        item = qt.QTreeWidgetItem(parent)
-        item.setText(0, name)
-        if format not in icons_cache:
-            icons_cache[format] = qt.QIcon(ICONS_DIR / f'{format}.png')
-        item.setIcon(0, icons_cache[format])
-        item.setData(0, Qt.UserRole, (self._next_id(), name, params, format))
-        if name == 'python':
-            self._start_item = item
-        return item
+    def _on_clicked(self, index):
+        if data := index.data(Qt.UserRole):
+            self._doc_clicked.emit(data)
+            # the children of a document are shown when it is opened
+            self.expand(index)
+        elif self.model().hasChildren(index):
+            self.setExpanded(index, not self.isExpanded(index))
+
+    def _reload(self, paths=None):
+        file = catalog.DOCS_FILE
+        try:
+            tree = catalog.load_tree()
+        except Exception as err:  # keep the current tree while docs.yaml is invalid
+            qt.showWarning(f'Cannot load {file}: {err}')
+            return
+
+        current = self.currentIndex().data(Qt.UserRole)
+        self._model._set_tree(tree)
+        self.expandToDepth(0)
+        if current:
+            self.setCurrentIndex(self._model._find(current[0]))
@@ -1,17 +1,35 @@
+import mimetypes
+import os
 from contextlib import contextmanager
 from time import perf_counter
-from urllib.parse import urljoin
+from urllib.parse import urljoin, urlparse
 
-import colorama
-import lxml.html
 import orjson as json
-import polars as pl
-from selectolax.parser import HTMLParser
 
-from . import Qt, qt
+# polars, lxml and selectolax are imported by the functions using them to keep them out of the startup time
+
+PARALLEL_PARSE_SIZE = 4 << 20  # total size of the genindex pages above which they are parsed by a process pool
+
+# types that are missing or wrong in some platform databases (e.g. .js as text/plain in the windows registry)
+MIME_TYPES = {
+    '.html': 'text/html',
+    '.htm': 'text/html',
+    '.js': 'text/javascript',
+    '.mjs': 'text/javascript',
+    '.css': 'text/css',
+    '.json': 'application/json',
+    '.svg': 'image/svg+xml',
+    '.woff': 'font/woff',
+    '.woff2': 'font/woff2',
+    '.ttf': 'font/ttf',
+    '.otf': 'font/otf',
+    '.wasm': 'application/wasm',
+}
 
 
 def shortcut(parent, key):
+    from . import Qt, qt
+
     s = qt.QShortcut(qt.QKeySequence(key), parent)
     s.setContext(Qt.ShortcutContext.WidgetWithChildrenShortcut)
     return s
@@ -22,15 +40,85 @@ def shortcuts(parent, keys):
         shortcut(parent, key).activated.connect(handler)
 
 
-def fix_html(html):
+def guess_mime(name):
+    path = name.split('?', 1)[0]
+    if (dot := path.rfind('.')) > path.rfind('/'):
+        if mime := MIME_TYPES.get(path[dot:].lower()):
+            return mime
+    return mimetypes.guess_type(path, strict=False)[0] or 'application/octet-stream'
+
+
+def accepted_encodings(header):
+    """Content codings of an Accept-Encoding header, except the ones refused with q=0"""
+    encodings = set()
+    for part in (header or '').split(','):
+        coding, *params = part.split(';')
+        q = next((param.split('=', 1)[1] for param in params if param.strip().startswith('q=')), '1')
+        try:
+            if (coding := coding.strip().lower()) and float(q) > 0:
+                encodings.add(coding)
+        except ValueError:
+            pass
+    return encodings
+
+
+def parse_size(text):
+    """Number of bytes of a size like 512k, 200MB or 2G"""
+    if isinstance(text, int):
+        return text
+    text = text.strip().lower().removesuffix('b')
+    for suffix, mult in (('k', 1 << 10), ('m', 1 << 20), ('g', 1 << 30)):
+        if text.endswith(suffix):
+            return int(float(text[:-1]) * mult)
+    return int(text)
+
+
+def extract_links(html, base_url='/'):
+    """Root relative paths of the same-site pages and resources referenced by a page"""
+    from selectolax.parser import HTMLParser
+
+    links = set()
+    for node in HTMLParser(html).css('a[href], link[href], script[src], img[src]'):
+        attrs = node.attributes
+        url = urlparse(urljoin(base_url, attrs.get('href') or attrs.get('src')))
+        if not url.scheme and not url.netloc and url.path:
+            links.add(url.path)
+    return links
+
+
+def extract_nav_links(html, base_url='/', limit=10):
+    """Root relative paths of the pages that are likely to be opened next: next/prev/up links then the toctree entries"""
+    from selectolax.parser import HTMLParser
+
     tree = HTMLParser(html)
-    for link in tree.css('link'):
+    nodes = tree.css('link[rel=next], a[rel=next], link[rel=prev], a[rel=prev], link[rel=up], a[rel=up], .toctree-wrapper a[href]')
+    page = urlparse(urljoin('/', base_url)).path
+    links = {}
+    for node in nodes:
+        url = urlparse(urljoin(base_url, node.attributes.get('href') or ''))
+        if not url.scheme and not url.netloc and url.path and url.path != page:
+            links[url.path] = None
+            if len(links) == limit:
+                break
+    return list(links)
+
+
+def fix_html(html, remove=()):
+    """Remove the nodes matching the remove selectors, return None if the page is unchanged"""
+    from selectolax.parser import HTMLParser
+
+    tree = HTMLParser(html)
+    changed = False
+    for link in tree.css('link[crossorigin]'):
         # crossorigin in <link rel="preload" as="font" type="font/woff2" crossorigin causes the font file not to be useable
-        attrs = link.attrs
-        if 'crossorigin' in attrs:
-            del attrs['crossorigin']
+        del link.attrs['crossorigin']
+        changed = True
+    for selector in remove:
+        for node in tree.css(selector):
+            node.decompose()
+            changed = True
 
-    return tree.html
+    return tree.html if changed else None
 
 
 def epoch():
@@ -39,10 +127,30 @@ def epoch():
     return int(time())
 
 
-def extract_genindex(html, base_url='/'):
-    tree = HTMLParser(html)
+def resolve_locations(df, base_url='/', column='location'):
+    """Resolve the relative urls of a column against base_url, the same as urljoin for each row"""
+    import polars as pl
+
+    hrefs = df[column]
+    base_dir = base_url[: base_url.rfind('/') + 1]
+    col = pl.col(column)
+    df = df.with_columns(
+        pl.when(col.str.starts_with('/') | col.str.contains('://', literal=True))
+        .then(col)
+        .when(col.str.starts_with('#'))
+        .then(pl.lit(base_url.split('#', 1)[0]) + col)
+        .otherwise(pl.lit(base_dir) + col)
+        .alias(column)
+    )
+    # dot segments are rare, leave them to urljoin
+    if (dotted := hrefs.str.contains('./', literal=True)).any():
+        df = df.with_columns(df[column].scatter(dotted.arg_true(), [urljoin(base_url, href) for href in hrefs.filter(dotted)]))
+    return df
+
+
+def _genindex_entries(tree):
     symbols = []
-    locations = []
+    hrefs = []
     for table in tree.tags('table'):
         for li in table.css('td > ul > li'):
             a = li.css_first('a')
@@ -50,34 +158,95 @@ def extract_genindex(html, base_url='/'):
             # assert text[0] != '(', li.parent.parent.tag
             symbol = text.split(' (', 1)[0]
             symbols.append(text)
-            locations.append(urljoin(base_url, a.attributes['href']))
+            hrefs.append(a.attributes['href'])
             if ul := li.css_first('ul'):
                 for a in ul.css('a'):
                     symbols.append(symbol + ' ' + a.text())
-                    locations.append(urljoin(base_url, a.attributes['href']))
-    return pl.DataFrame({'symbol': symbols, 'location': locations})
+                    hrefs.append(a.attributes['href'])
+    return symbols, hrefs
 
 
-def extract_searchindex(content, base_url='/'):
+def _genindex_pages(tree):
+    pages = {}
+    for a in tree.css('a[href^="genindex-"]'):
+        href = a.attributes['href'].split('#', 1)[0]
+        if href.endswith('.html'):
+            pages[href] = None
+    # the letter pages can be parsed in parallel, genindex-all.html is one large page with the same entries
+    letters = [page for page in pages if page != 'genindex-all.html']
+    return letters or list(pages) or None
+
+
+def parse_genindex(html):
+    """Symbols and unresolved links of a Sphinx genindex page, picklable so that it can run in a worker process"""
+    from selectolax.parser import HTMLParser
+
+    return _genindex_entries(HTMLParser(html))
+
+
+def read_genindex(html):
+    """Symbols, links and letter pages of a genindex.html, the pages are None unless it is split by html_split_index"""
+    from selectolax.parser import HTMLParser
+
+    tree = HTMLParser(html)
+    symbols, hrefs = _genindex_entries(tree)
+    return symbols, hrefs, None if symbols else _genindex_pages(tree)
+
+
+def genindex_frame(symbols, hrefs, base_url='/'):
+    import polars as pl
+
+    return resolve_locations(pl.DataFrame({'symbol': symbols, 'location': hrefs}, schema={'symbol': pl.String, 'location': pl.String}), base_url)
+
+
+def extract_genindex_pages(pages, base_url='/'):
+    """Merged index of the letter pages of a split genindex, large indexes are parsed by a process pool"""
+    if len(pages) > 1 and sum(len(page) for page in pages) > PARALLEL_PARSE_SIZE:
+        import multiprocessing
+        from concurrent.futures import ProcessPoolExecutor
+
+        # forking a process with Qt threads is unsafe
+        with ProcessPoolExecutor(min(len(pages), os.cpu_count() or 1), mp_context=multiprocessing.get_context('spawn')) as pool:
+            results = list(pool.map(parse_genindex, pages))
+    else:
+        results = [parse_genindex(page) for page in pages]
+
+    symbols = [symbol for result in results for symbol in result[0]]
+    hrefs = [href for result in results for href in result[1]]
+    return genindex_frame(symbols, hrefs, base_url)
+
+
+def load_searchindex(content):
+    """Data of a Sphinx searchindex.js, None if the file is not one"""
     if not content.startswith(b'Search.setIndex'):
         return
 
-    symbols = []
-    locations = []
-
     try:
-        data = json.loads(content[16:-1])
+        return json.loads(content[16:-1])
     except Exception as err:
         print(content)
         raise err
 
-    # locations
+
+def searchindex_pages(data):
+    """Docnames of a searchindex and whether .html must be added to them"""
     try:
-        docnames = data['docnames']
-        add_html = True
+        return data['docnames'], True
     except KeyError:
-        docnames = data['docurls']
-        add_html = False
+        return data['docurls'], False
+
+
+def extract_searchindex(content, base_url='/'):
+    import polars as pl
+
+    if (data := load_searchindex(content)) is None:
+        return
+
+    symbols = []
+    locations = []
+
+    # locations
+    docnames, add_html = searchindex_pages(data)
 
     # symbols
     indexentries = data['indexentries']
@@ -106,6 +275,9 @@ def extract_searchindex(content, base_url='/'):
 
 
 def extract_hhk(content):
+    import lxml.html
+    import polars as pl
+
     tree = lxml.html.fromstring(content)
 
     symbols = []
@@ -129,5 +301,7 @@ def timeit(*args):
     if args:
         if not args[0]:
             return
+        import colorama
+
         print(colorama.Fore.BLUE + ' '.join(args) + ': ' + colorama.Fore.RESET, end='')
     print(perf_counter() - t)
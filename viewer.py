@@ -1,11 +1,13 @@
 import logging
+from threading import Thread
 from urllib.parse import urljoin
 
+import orjson as json
 from recordclass import dataobject
 
-from . import DOCS_DIR, Qt, qt, term
-from .index import Widget as IndexWidget
+from . import DOCS_DIR, Qt, qt, settings, term
 from .server import HttpServer
+from .watcher import get_watcher
 
 logger = logging.getLogger(__name__)
 
@@ -15,6 +17,7 @@ class UserScript(dataobject):
     file: str
     prefix: str = ''
     suffix: str = ''
+    live: bool = False  # also applied to the current page when the file changes
     time: int = None
     script: qt.QWebEngineScript = None
 
@@ -30,13 +33,13 @@ class Interceptor(qt.QWebEngineUrlRequestInterceptor):
         def block():
             logger.warn('%s %s', term.red('BLOCK'), url.url())
             info.block(True)
-            self._doc.counter['block'] += 1
+            self._doc.metrics.incr('block')
 
         method = info.requestMethod()
         if method != b'GET':
             print(term.red('BLOCKED'), term.yellow(str(method)), url)
             info.block(True)
-            self._doc.counter['block'] += 1
+            self._doc.metrics.incr('block')
 
         doc = self._doc
         server_prefix = self.parent().parent()._prefix
@@ -46,7 +49,7 @@ class Interceptor(qt.QWebEngineUrlRequestInterceptor):
                     new_url = urljoin(server_prefix, url.path())
                     # ic('redirect', url.url(), new_url)
                     info.redirect(qt.QUrl(new_url))
-                elif doc.is_whitelisted(url):
+                elif doc.is_whitelisted(url.host()):
                     new_url = qt.QUrl(server_prefix + url.url())
                     # ic('redirect', url.url(), new_url)
                     info.redirect(new_url)
@@ -58,7 +61,7 @@ class Interceptor(qt.QWebEngineUrlRequestInterceptor):
                         new_url = urljoin(server_prefix, url.path())
                         # ic('redirect', url.url(), new_url)
                         info.redirect(qt.QUrl(new_url))
-                    elif doc.is_whitelisted(url):
+                    elif doc.is_whitelisted(url.host()):
                         new_url = qt.QUrl(server_prefix + url.url())
                         # ic('redirect', url.url(), new_url)
                         info.redirect(new_url)
@@ -95,7 +98,9 @@ class WebEnginePage(qt.QWebEnginePage):
 
 
 class ViewerWidget(qt.QWidget):
-    def __init__(self, doc):
+    _rescanned = qt.Signal(object)  # names changed in the directory, emitted by the rescan thread
+
+    def __init__(self, doc, path=None):
         super().__init__()
 
         self._doc = doc
@@ -104,20 +109,37 @@ class ViewerWidget(qt.QWidget):
         self._prefix = self._server.prefix
         self._userscripts = (
             UserScript('userscript', DOCS_DIR / doc.name / f'{doc.name}.js'),
-            UserScript('userstyle', DOCS_DIR / doc.name / f'{doc.name}.css', prefix='const css = new CSSStyleSheet(); css.replaceSync(`', suffix='`); document.adoptedStyleSheets.push(css);'),
+            UserScript(
+                'userstyle',
+                DOCS_DIR / doc.name / f'{doc.name}.css',
+                # the sheet is kept on window so that a changed file replaces it instead of adding another one
+                prefix='const css = window._userstyle || (window._userstyle = new CSSStyleSheet()); css.replaceSync(',
+                suffix='); if (!document.adoptedStyleSheets.includes(css)) document.adoptedStyleSheets = [...document.adoptedStyleSheets, css];',
+                live=True,
+            ),
         )
-        self._userstyle_file = DOCS_DIR / self._doc.name / f'{self._doc.name}.css'
-        self._userscript_time = None
-        self._userstyle_time = None
 
         self._setup_ui()
 
-        url = qt.QUrl(self._prefix)
-        if start := self._doc.start:
-            url.setPath('/' + start.lstrip('/'))
+        if path:
+            # path of a restored session, may contain query and fragment
+            url = qt.QUrl(self._prefix + path.lstrip('/'))
+        else:
+            url = qt.QUrl(self._prefix)
+            if start := self._doc.start:
+                url.setPath('/' + start.lstrip('/'))
         self._webengine.load(url)
 
+    def _current_path(self):
+        url = self._page.url().toString()
+        if url.startswith(self._prefix):
+            return url[len(self._prefix) - 1 :]
+
     def _cleanup(self):
+        if self._files_watch is not None:
+            self._files_watch._close()
+            self._files_watch = None  # a rescan still running must not watch the directories again
+        self._userscript_watch._close()
         self._server.stop()
         self._doc.stop()
 
@@ -134,7 +156,6 @@ class ViewerWidget(qt.QWidget):
 
         self._page = page = WebEnginePage(self)
         page.loadStarted.connect(self._doc.reset_counter)
-        page.navigationRequested.connect(lambda _: self._load_userscript())
         self._webengine = webengine = qt.QWebEngineView(page)
         inspector_splitter.addWidget(webengine)
 
@@ -143,15 +164,69 @@ class ViewerWidget(qt.QWidget):
         self._inspector_view = None
 
         doc = self._doc
+        self._index = None
         if (res := doc.get_index()) is not None:
-            self._index = index = IndexWidget(res)
-            index.sizePolicy().setHorizontalPolicy(qt.QSizePolicy.Policy.Fixed)
+            self._index = index = self._create_index(res)
             splitter.addWidget(index)
-            index._item_clicked.connect(self._on_index_clicked)
-        else:
-            self._index = None
+
+        # locally built documents are rebuilt while they are open
+        self._files_watch = None
+        if doc.format == 'directory':
+            self._files_watch = get_watcher().watch(doc.directories(), self._on_files_changed, delay=300, parent=self)
+            self._rescanned.connect(self._on_rescanned)
 
         self._load_userscript()
+        self._userscript_watch = get_watcher().watch(self._userscript_paths(), self._on_userscript_changed, parent=self)
+
+    def _create_index(self, res):
+        from .index import Widget as IndexWidget  # polars is only imported with an index
+
+        index = IndexWidget(res, self._doc.get_search_index)
+        index.sizePolicy().setHorizontalPolicy(qt.QSizePolicy.Policy.Fixed)
+        index._item_clicked.connect(self._on_index_clicked)
+        index._item_dwelled.connect(self._prefetch)
+        return index
+
+    def _reload_index(self):
+        old = self._index
+        if (res := self._doc.get_index()) is None:
+            self._index = None
+            if old is not None:
+                old.deleteLater()
+            return
+
+        self._index = index = self._create_index(res)
+        if old is None:
+            self._splitter.addWidget(index)
+        else:
+            self._splitter.replaceWidget(self._splitter.indexOf(old), index)
+            index._edit.setText(old._edit.text())
+            old.deleteLater()
+
+    def _on_files_changed(self, paths):
+        # scanning a large tree would block the page
+        Thread(target=self._rescan, name=f'rescan-{self._doc.name}', daemon=True).start()
+
+    def _rescan(self):
+        changed = self._doc.rescan()
+        try:
+            self._rescanned.emit(changed)
+        except RuntimeError:  # the widget was deleted
+            pass
+
+    def _on_rescanned(self, changed):
+        doc = self._doc
+        # directories are added and removed by the build
+        if self._files_watch is not None:
+            self._files_watch._set_paths(doc.directories())
+        if not changed:
+            return
+
+        if any(doc.is_index(name) for name in changed):
+            self._reload_index()
+        path = (self._current_path() or '/').split('#', 1)[0].split('?', 1)[0].lstrip('/')
+        if doc.resolve(path or 'index.html') in changed or any(name.endswith(('.css', '.js')) for name in changed):
+            self._page.triggerAction(qt.QWebEnginePage.WebAction.ReloadAndBypassCache)
 
     def _on_index_clicked(self, location):
         if '#' in location:
@@ -163,26 +238,61 @@ class ViewerWidget(qt.QWidget):
             url = qt.QUrl(self._prefix + location.lstrip('/'))
         self._page.setUrl(url)
 
-    def _load_userscript(self):
+    def _prefetch(self, location):
+        """Warm the page of an index entry before it is clicked"""
+        if location is None:
+            self._doc.hint(None)
+            return
+        path = location.split('#', 1)[0].lstrip('/')
+        if path.startswith('http'):
+            return
+        self._doc.hint(path)
+
+        # the renderer also keeps the response in its http cache
+        if settings.get('prefetch.renderer'):
+            url = json.dumps(self._prefix + path).decode()
+            self._page.runJavaScript(
+                "(function() { document.querySelectorAll('link[data-prefetch]').forEach(e => e.remove());"
+                f"const l = document.createElement('link'); l.rel = 'prefetch'; l.href = {url}; l.dataset.prefetch = ''; document.head.append(l); }})();"
+            )
+
+    def _userscript_paths(self):
+        # a missing file is noticed through its directory, a change in the directory only costs the stats of the two files
+        return {us.file if us.file.exists() else us.file.parent for us in self._userscripts}
+
+    def _on_userscript_changed(self, paths):
+        self._load_userscript(update_page=True)
+        self._userscript_watch._set_paths(self._userscript_paths())
+
+    def _load_userscript(self, update_page=False):
+        """Update the scripts injected in the next pages, the live ones are also applied to the current page"""
         scripts = self._page.scripts()
         for us in self._userscripts:
             file = us.file
             if file.exists() and file.size > 0:
                 if us.time is None or us.time < file.mtime:
+                    text = file.read_text()
+                    if us.live:
+                        text = json.dumps(text).decode()
+                    source = us.prefix + text + us.suffix
                     script = qt.QWebEngineScript()
                     script.setName(us.name)
                     script.setInjectionPoint(qt.QWebEngineScript.InjectionPoint.DocumentReady)
-                    script.setSourceCode('(function() {' + us.prefix + file.read_text() + us.suffix + '})();')
+                    script.setSourceCode('(function() {' + source + '})();')
 
                     if us.script:
                         scripts.remove(us.script)
                     scripts.insert(script)
+                    if us.live and update_page:
+                        self._page.runJavaScript(script.sourceCode())
                     us.time = file.mtime
                     us.script = script
             else:
                 # file is deleted
                 if us.script:
                     scripts.remove(us.script)
+                    if us.live and update_page:
+                        self._page.runJavaScript('(function() {' + us.prefix + '""' + us.suffix + '})();')
                     us.time = None
                     us.script = None
 
@@ -0,0 +1,98 @@
+import os
+
+from . import qt
+
+_watcher = None
+
+
+def get_watcher():
+    global _watcher
+    if _watcher is None:
+        _watcher = FileWatcher()
+    return _watcher
+
+
+class Watch(qt.QObject):
+    """Paths watched for one callback, the callback gets the changed paths once the changes settled"""
+
+    def __init__(self, service, callback, delay, parent):
+        super().__init__(parent)
+        self._service = service
+        self._callback = callback
+        self._paths = set()
+        self._changed = set()
+
+        self._timer = timer = qt.QTimer(self)
+        timer.setSingleShot(True)
+        timer.setInterval(delay)
+        timer.timeout.connect(self._fire)
+
+    def _set_paths(self, paths):
+        paths = {str(path) for path in paths}
+        self._service._remove(self, self._paths - paths)
+        self._service._add(self, paths - self._paths)
+        self._paths = paths
+
+    def _close(self):
+        self._timer.stop()
+        self._service._remove(self, self._paths)
+        self._paths = set()
+
+    def _notify(self, path):
+        self._changed.add(path)
+        self._timer.start()
+
+    def _fire(self):
+        changed, self._changed = self._changed, set()
+        self._service._rewatch(changed)
+        self._callback(changed)
+
+
+class FileWatcher(qt.QObject):
+    """One QFileSystemWatcher shared by the application, each path is watched once for any number of callbacks"""
+
+    def __init__(self):
+        super().__init__()
+        self._watcher = watcher = qt.QFileSystemWatcher(self)
+        watcher.fileChanged.connect(self._changed)
+        watcher.directoryChanged.connect(self._changed)
+        self._watches = {}  # path -> set of Watch
+
+    def watch(self, paths, callback, delay=200, parent=None):
+        """Call callback(changed paths) after the last change of a burst, editors and builds write files several times"""
+        watch = Watch(self, callback, delay, parent)
+        watch._set_paths(paths)
+        return watch
+
+    def _add(self, watch, paths):
+        new = []
+        for path in paths:
+            if path not in self._watches:
+                self._watches[path] = set()
+                if os.path.exists(path):
+                    new.append(path)
+            self._watches[path].add(watch)
+        if new:
+            self._watcher.addPaths(new)
+
+    def _remove(self, watch, paths):
+        old = []
+        for path in paths:
+            if (watches := self._watches.get(path)) is not None:
+                watches.discard(watch)
+                if not watches:
+                    del self._watches[path]
+                    old.append(path)
+        if old := [path for path in old if path in self._watcher.files() or path in self._watcher.directories()]:
+            self._watcher.removePaths(old)
+
+    def _rewatch(self, paths):
+        # files replaced by editors are removed from the watcher, the new file may only exist after the burst of changes
+        for path in paths:
+            if path in self._watches and os.path.exists(path) and path not in self._watcher.files() and path not in self._watcher.directories():
+                self._watcher.addPath(path)
+
+    def _changed(self, path):
+        self._rewatch((path,))
+        for watch in list(self._watches.get(path, ())):
+            watch._notify(path)